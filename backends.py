@@ -0,0 +1,231 @@
+"""Text generation backends.
+
+StudyBot talks to a Backend, never to a model class directly. Sampling
+parameters use GPT4All's names (max_tokens, temp, top_k, top_p,
+repeat_penalty); backends translate them as needed.
+
+A `prefix` parameter (a string, or a tuple of nested strings, that the
+prompt starts with) marks text that repeats across calls, such as the
+instruction template or a chapter's packed context. Backends that can keep
+evaluated prompt state reuse it; the others ignore it.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from context import estimate_tokens
+from model_host import MODEL_NAME, RemoteModel, load_local_model
+
+
+class BackendError(RuntimeError):
+    """A backend failed to produce a completion (connection, server or model error)."""
+
+
+class Backend:
+    """Single, streaming and batched generation over one model."""
+
+    name = "backend"
+
+    def stream(self, prompt, should_continue=None, **params):
+        """Yield tokens as they are generated.
+
+        should_continue() is polled between tokens; returning False stops
+        generation early.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompt, should_continue=None, **params):
+        return "".join(self.stream(prompt, should_continue, **params))
+
+    def generate_batch(self, prompts, should_continue=None, on_complete=None, **params):
+        """Generate a completion for every prompt; results are in prompt order.
+
+        on_complete(index, text) is called as each prompt finishes. Backends
+        that can serve several prompts at once override this; the default
+        runs them one after another.
+        """
+        results = [None] * len(prompts)
+        for i, prompt in enumerate(prompts):
+            if should_continue and not should_continue():
+                break
+            results[i] = self.generate(prompt, should_continue, **params)
+            if on_complete:
+                on_complete(i, results[i])
+        return results
+
+    def close(self):
+        pass
+
+
+class GPT4AllBackend(Backend):
+    """A GPT4All model in this process, or one kept resident by model_host.py."""
+
+    def __init__(self, model, name=MODEL_NAME):
+        self.model = model
+        self.name = name
+        self._lock = threading.Lock()  # GPT4All runs one generation at a time
+        if hasattr(model, "count_tokens"):
+            self.count_tokens = model.count_tokens
+
+    @classmethod
+    def load(cls):
+        """Load the local GGUF from models/ (slow; see StudyBot._load_backend)."""
+        return cls(load_local_model())
+
+    @classmethod
+    def connect(cls, socket_path):
+        """Attach to a model daemon; raises OSError/ValueError if it isn't answering."""
+        remote = RemoteModel(socket_path)
+        remote.ping()
+        return cls(remote)
+
+    def stream(self, prompt, should_continue=None, **params):
+        def callback(token_id, response):
+            return should_continue() if should_continue else True
+
+        if not getattr(self.model, "accepts_prefix", False):
+            params.pop("prefix", None)
+        with self._lock:
+            yield from self.model.generate(prompt, streaming=True, callback=callback, **params)
+
+    def close(self):
+        close = getattr(self.model, "close", None)
+        if close:
+            close()
+
+
+class StubBackend(Backend):
+    """Deterministic, instant completions for tests and benchmarks.
+
+    The answer depends only on the prompt and max_tokens, so repeated calls
+    (and cache keys) are reproducible.
+    """
+
+    name = "stub"
+
+    def __init__(self, answer_tokens=32):
+        self.answer_tokens = answer_tokens
+        self.calls = 0
+
+    def stream(self, prompt, should_continue=None, **params):
+        self.calls += 1
+        seed = hashlib.sha256(prompt.encode("utf-8")).digest()
+        for i in range(min(self.answer_tokens, params.get("max_tokens", self.answer_tokens))):
+            if should_continue and not should_continue():
+                return
+            yield f" tok{seed[i % len(seed)]}"
+
+
+class LlamaCppBackend(Backend):
+    """Client for a llama.cpp-style HTTP server (`llama-server`'s /completion API).
+
+    Batches are sent as concurrent requests so a server started with several
+    slots (-np) decodes them together; `parallel` should match its slot count.
+    Requests set cache_prompt, so the server keeps each slot's evaluated
+    prompt and only evaluates what differs from it; `prefix` is not needed.
+    Token counts come from the server's /tokenize endpoint.
+    """
+
+    PARAM_NAMES = {"max_tokens": "n_predict", "temp": "temperature"}
+
+    def __init__(self, base_url="http://127.0.0.1:8080", parallel=4, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.name = f"llamacpp:{self.base_url}"
+        self.parallel = parallel
+        self.timeout = timeout
+        self._token_counts = {}  # text -> count; context packing asks about the same chunks repeatedly
+        self.max_token_counts = 4096
+
+    def _request(self, prompt, params, stream):
+        body = {self.PARAM_NAMES.get(key, key): value for key, value in params.items() if key != "prefix"}
+        body.setdefault("n_predict", 200)
+        body.update(prompt=prompt, stream=stream, cache_prompt=True)
+        request = urllib.request.Request(
+            f"{self.base_url}/completion",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except (urllib.error.URLError, OSError) as e:
+            raise BackendError(f"llama.cpp server at {self.base_url} failed: {str(e)}") from e
+
+    def count_tokens(self, text):
+        """Tokens in text by the server's tokenizer, or an estimate if the server can't say."""
+        count = self._token_counts.get(text)
+        if count is not None:
+            return count
+        request = urllib.request.Request(
+            f"{self.base_url}/tokenize",
+            data=json.dumps({"content": text}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                count = len(json.loads(response.read())["tokens"])
+        except (urllib.error.URLError, OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Token count from {self.base_url} failed ({str(e)}), estimating")
+            return estimate_tokens(text)
+        if len(self._token_counts) >= self.max_token_counts:
+            self._token_counts.clear()
+        self._token_counts[text] = count
+        return count
+
+    def stream(self, prompt, should_continue=None, **params):
+        # Closing the response drops the connection, which stops the server's generation
+        with self._request(prompt, params, stream=True) as response:
+            for line in response:
+                if not line.startswith(b"data: "):
+                    continue
+                message = json.loads(line[6:])
+                if message.get("content"):
+                    yield message["content"]
+                if message.get("stop"):
+                    return
+                if should_continue and not should_continue():
+                    return
+
+    def generate(self, prompt, should_continue=None, **params):
+        with self._request(prompt, params, stream=False) as response:
+            return json.loads(response.read())["content"]
+
+    def generate_batch(self, prompts, should_continue=None, on_complete=None, **params):
+        results = [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.parallel, len(prompts)))) as pool:
+            futures = {pool.submit(self.generate, prompt, **params): i for i, prompt in enumerate(prompts)}
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    if on_complete:
+                        on_complete(i, results[i])
+                    if should_continue and not should_continue():
+                        break
+            finally:
+                for future in futures:
+                    future.cancel()
+        return results
+
+
+def make_backend(spec):
+    """Build a backend from a spec: "gpt4all", "stub" or a llama.cpp server URL."""
+    if spec == "gpt4all":
+        return GPT4AllBackend.load()
+    if spec == "stub":
+        return StubBackend()
+    if spec.startswith(("http://", "https://")):
+        return LlamaCppBackend(spec)
+    raise ValueError(f"Unknown backend: {spec}")
+
+
+def default_backend_spec():
+    """The backend named by $STUDYBOT_BACKEND, or None for the default GPT4All setup."""
+    spec = os.environ.get("STUDYBOT_BACKEND", "").strip()
+    if spec:
+        logging.info(f"Using backend from STUDYBOT_BACKEND: {spec}")
+    return spec or None
@@ -0,0 +1,259 @@
+"""Benchmarks for the StudyBot pipeline.
+
+Runs extraction (text and scanned PDFs), chunking, chapter retrieval,
+formula lookups and image OCR against synthetic PDFs of several sizes plus
+documents/example.pdf, using a stub model so no GGUF file is needed.
+Results are printed (or written with --output) as JSON for comparing runs:
+
+    python benchmark.py --output before.json
+    python benchmark.py --quick
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+
+from main import StudyBot
+from backends import StubBackend
+from response_cache import ResponseCache
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_PDF = os.path.join(REPO_DIR, "documents", "example.pdf")
+
+VOCABULARY = """force mass acceleration velocity momentum energy power work voltage current
+resistance charge capacitor inductor field magnetic electric wave frequency wavelength
+pressure volume temperature heat entropy density gravity orbit friction torque lens
+refraction reflection photon electron nucleus decay isotope circuit series parallel""".split()
+
+QUESTIONS = [
+    "What is the relation between force mass and acceleration?",
+    "How does a capacitor store energy?",
+    "Explain refraction of light through a lens",
+    "What determines the frequency of a wave?",
+    "How is pressure related to volume and temperature?",
+    "Describe radioactive decay of an isotope",
+]
+
+
+def make_text_pdf(path, pages, words_per_page=350, seed=0):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        sentences = []
+        for _ in range(words_per_page // 10):
+            sentences.append(" ".join(rng.choice(VOCABULARY) for _ in range(10)).capitalize() + ".")
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), " ".join(sentences), fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+def make_scanned_pdf(path, pages, seed=0):
+    """Pages that are only an image of text, so extraction has to OCR them."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        source = fitz.open()
+        src_page = source.new_page()
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(120))
+        src_page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=12)
+        pix = src_page.get_pixmap(dpi=150)
+        page = doc.new_page()
+        page.insert_image(page.rect, pixmap=pix)
+        source.close()
+    doc.save(path)
+    doc.close()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its reaped children, in MB."""
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024  # bytes vs KB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return {"self": round(own, 1), "children": round(children, 1)}
+
+
+def measure(fn, repeat, items=1, unit="call", warmup=1):
+    """Time repeat calls of fn(i); each call handles `items` units (for throughput)."""
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies)
+    total = latencies.sum()
+    return {
+        "runs": repeat,
+        "items_per_run": items,
+        "unit": unit,
+        "throughput_per_s": round(repeat * items / total, 2) if total else None,
+        "mean_ms": round(latencies.mean() * 1000, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return False
+
+
+def fresh_bot():
+    bot = StudyBot(backend=StubBackend())
+    # Measure retrieval and prompt building, not repeated hits in the response cache
+    bot.cache = ResponseCache(max_entries=0)
+    return bot
+
+
+def bench_extraction(bot, path, pages, repeat):
+    return measure(lambda i: bot.extract_full_pdf_content(path), repeat, pages, "page")
+
+
+def bench_chunking(bot, text, repeat):
+    chunks = len(bot.split_text_into_chunks(text))
+    result = measure(lambda i: bot.split_text_into_chunks(text), repeat, len(text), "char")
+    result["chunks"] = chunks
+    return result
+
+
+def bench_retrieval(bot, path, repeat):
+    bot.index_chapter(path)
+    ask = lambda i: QUESTIONS[i % len(QUESTIONS)]
+    return {
+        "retrieve_chunks": measure(lambda i: bot.retrieve_chunks(ask(i), k=10), repeat, unit="query"),
+        "answer_from_chapter": measure(lambda i: bot.answer_from_chapter(ask(i)), repeat, unit="query"),
+        "indepth_query": measure(lambda i: bot.indepth_query(ask(i)), repeat, unit="query"),
+        "chunks": len(bot.indexed_db),
+    }
+
+
+def bench_formulas(bot, repeat):
+    rng = random.Random(1)
+    # Nonsense names can't fuzzy-match each other, so every first ask is a miss
+    queries = [f"{rng.choice(VOCABULARY)} q{rng.getrandbits(40):x} z{rng.getrandbits(40):x}"
+               for _ in range(repeat)]
+    miss = measure(lambda i: bot.get_formula(queries[i]), repeat, unit="query", warmup=0)
+    # Each miss saved its answer, so asking again is served from the database
+    hit = measure(lambda i: bot.get_formula(queries[i]), repeat, unit="query")
+    return {"miss": miss, "hit": hit, "entries": len(bot.formulas_db)}
+
+
+def bench_analyze_image(bot, path, repeat):
+    with fitz.open(path) as doc:
+        pix = doc[0].get_pixmap(dpi=150)
+        image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        image = np.ascontiguousarray(image[:, :, :3][:, :, ::-1])  # BGR, as the OCR path expects
+    return measure(lambda i: bot.analyze_image(image, 1), repeat, unit="image")
+
+
+def run(sizes, scanned_sizes, repeat, workdir):
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "commit": git_commit(),
+            "sizes": sizes,
+            "scanned_sizes": scanned_sizes,
+            "repeat": repeat,
+        },
+        "cases": {},
+    }
+    cases = results["cases"]
+    has_ocr = tesseract_available()
+    results["meta"]["tesseract"] = has_ocr
+    bot = fresh_bot()
+
+    pdfs = {}
+    for pages in sizes:
+        path = os.path.join(workdir, f"text_{pages}.pdf")
+        make_text_pdf(path, pages)
+        pdfs[f"text_{pages}p"] = (path, pages)
+    if os.path.exists(EXAMPLE_PDF):
+        with fitz.open(EXAMPLE_PDF) as doc:
+            pdfs["example.pdf"] = (EXAMPLE_PDF, len(doc))
+
+    for name, (path, pages) in pdfs.items():
+        logging.info(f"Benchmarking {name}")
+        cases[f"extract/{name}"] = bench_extraction(bot, path, pages, repeat)
+        text = bot.extract_full_pdf_content(path)
+        cases[f"chunk/{name}"] = bench_chunking(bot, text, repeat)
+        cases[f"retrieval/{name}"] = bench_retrieval(fresh_bot(), path, repeat * 5)
+
+    for pages in scanned_sizes:
+        name = f"scanned_{pages}p"
+        path = os.path.join(workdir, f"{name}.pdf")
+        make_scanned_pdf(path, pages)
+        if not has_ocr:
+            cases[f"extract/{name}"] = {"skipped": "tesseract is not installed"}
+            continue
+        logging.info(f"Benchmarking {name}")
+        cases[f"extract/{name}"] = bench_extraction(bot, path, pages, repeat)
+        if pages == scanned_sizes[0]:
+            cases["analyze_image"] = bench_analyze_image(bot, path, repeat * 3)
+    if not has_ocr:
+        cases["analyze_image"] = {"skipped": "tesseract is not installed"}
+
+    cases["get_formula"] = bench_formulas(bot, repeat * 10)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the StudyBot pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200],
+                        help="page counts of the synthetic text PDFs")
+    parser.add_argument("--scanned-sizes", type=int, nargs="+", default=[4, 16],
+                        help="page counts of the synthetic scanned PDFs")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--quick", action="store_true", help="small sizes and few runs")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes, args.scanned_sizes, args.repeat = [10], [2], 2
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # The bot keeps its caches and formula log in the working directory
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="studybot-bench-") as workdir:
+        os.chdir(workdir)
+        try:
+            results = run(args.sizes, args.scanned_sizes, args.repeat, workdir)
+        finally:
+            os.chdir(previous_cwd)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
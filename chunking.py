@@ -0,0 +1,69 @@
+import re
+from collections import namedtuple
+
+# page is 1-based; offset is the chunk's start position within that page's text
+Chunk = namedtuple("Chunk", ["text", "page", "offset"])
+
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]?\s")
+
+
+def _find_cut(text, start, end, boundary, min_len):
+    """Best place to end a chunk in text[start:end] without copying the slice."""
+    earliest = start + min_len
+    if boundary in ("paragraph", "sentence"):
+        cut = text.rfind("\n\n", earliest, end)
+        if cut != -1:
+            return cut
+    if boundary == "sentence":
+        cut = -1
+        for match in SENTENCE_END_RE.finditer(text, earliest, end):
+            cut = match.end()
+        if cut != -1:
+            return cut
+    if boundary != "none":
+        cut = text.rfind("\n", earliest, end)
+        if cut == -1:
+            cut = text.rfind(" ", earliest, end)
+        if cut != -1:
+            return cut
+    return end
+
+
+def iter_chunks(pages, chunk_size=1000, overlap=0, boundary="paragraph"):
+    """Yield Chunks from an iterable of page texts, one page in memory at a time.
+
+    Chunks never span pages, are at most chunk_size characters, prefer to end
+    at a paragraph (or sentence, with boundary="sentence") break in the second
+    half of the window, and start `overlap` characters before the previous
+    chunk ended. Positions are tracked as offsets, so the text is never
+    re-sliced as a whole. A chunk can be as short as half the window, so
+    overlap must stay below chunk_size // 2, and it never covers more than
+    half of the previous chunk: each step advances by at least a quarter of
+    the window.
+    """
+    min_len = chunk_size // 2
+    if overlap >= min_len:
+        raise ValueError("overlap must be smaller than half of chunk_size")
+    for page_no, text in enumerate(pages, start=1):
+        n = len(text)
+        pos = 0
+        while pos < n:
+            # Skip leading whitespace without copying
+            while pos < n and text[pos].isspace():
+                pos += 1
+            if pos >= n:
+                break
+            end = min(pos + chunk_size, n)
+            cut = end if end == n else _find_cut(text, pos, end, boundary, min_len)
+            chunk = text[pos:cut].strip()
+            if chunk:
+                yield Chunk(chunk, page_no, pos)
+            if cut >= n:
+                break
+            next_pos = cut
+            back = min(overlap, (cut - pos) // 2)
+            if back:
+                # Start the overlap on a word boundary
+                space = text.find(" ", cut - back, cut)
+                next_pos = space + 1 if space != -1 else cut - back
+            pos = max(next_pos, pos + 1)
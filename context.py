@@ -0,0 +1,78 @@
+import re
+import math
+
+TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Rough llama-style token count: words and punctuation, plus subword slack.
+
+    Used when the model can't count tokens itself; deliberately errs high so
+    packed prompts stay inside the context window.
+    """
+    return math.ceil(len(TOKEN_PIECE_RE.findall(text)) * 1.3)
+
+
+def _dedup_key(text):
+    return " ".join(text.lower().split())
+
+
+def pack_context(chunks, budget, count_tokens=estimate_tokens, separator="\n\n", min_fragment=64,
+                 max_skips=8):
+    """Greedily pack chunks (highest priority first) into at most `budget` tokens.
+
+    Exact duplicates (ignoring case and whitespace) are skipped. A chunk that
+    doesn't fit is skipped in favour of later, smaller ones; if at least
+    `min_fragment` tokens remain, its leading part is used instead. Packing
+    stops after `max_skips` chunks in a row have not fitted.
+    Returns (context_text, tokens_used).
+    """
+    parts = []
+    seen = set()
+    used = 0
+    skips = 0
+    sep_tokens = count_tokens(separator) if separator.strip() else 0
+    for chunk in chunks:
+        remaining = budget - used - (sep_tokens if parts else 0)
+        if remaining <= 0:
+            break
+        key = _dedup_key(chunk)
+        if not key or key in seen:
+            continue
+        tokens = count_tokens(chunk)
+        if tokens > remaining:
+            if remaining < min_fragment:
+                skips += 1
+                if skips >= max_skips:
+                    break
+                continue
+            # Cut proportionally, then trim until the estimate fits
+            chunk = chunk[:int(len(chunk) * remaining / tokens)]
+            tokens = count_tokens(chunk)
+            while tokens > remaining and chunk:
+                chunk = chunk[:int(len(chunk) * 0.9)]
+                tokens = count_tokens(chunk)
+            if not chunk:
+                continue
+        skips = 0
+        seen.add(key)
+        parts.append(chunk)
+        used += tokens + (sep_tokens if len(parts) > 1 else 0)
+    return separator.join(parts), used
+
+
+def split_into_groups(texts, budget, count_tokens=estimate_tokens):
+    """Split texts, in order, into consecutive groups of at most ~budget tokens each."""
+    groups = []
+    current = []
+    used = 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and used + tokens > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
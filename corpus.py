@@ -0,0 +1,239 @@
+import os
+import json
+import heapq
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from retrieval import BM25Index, pack_postings, tokenize
+from index_store import open_index_file, write_index_file
+
+CorpusHit = namedtuple("CorpusHit", ["file", "page", "text", "score"])
+
+
+def _index_document(indexer, file_path, cache_key):
+    """Process pool worker: make sure the PDF has a stored index; returns its key."""
+    indexer.load_index(file_path, cache_key)
+    return cache_key
+
+
+class Segment:
+    """Merged BM25 postings for a group of documents, memory-mapped from disk."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mm, header, sections = open_index_file(path)
+        self.documents = [tuple(doc) for doc in header["documents"]]  # (file name, index key)
+        self.chunk_docs = sections["chunk_docs"]  # segment chunk id -> position in documents
+        self.chunk_ids = sections["chunk_ids"]  # segment chunk id -> chunk id in its document
+        bm25 = header["bm25"]
+        self.retriever = BM25Index.from_packed(
+            {term: tuple(entry) for term, entry in bm25["vocab"].items()},
+            sections["postings"],
+            sections["doc_lens"],
+            bm25["total_len"],
+            k1=bm25["k1"],
+            b=bm25["b"],
+        )
+
+    @staticmethod
+    def write(path, documents, stores):
+        """Merge the postings of `stores` (StoredIndex, one per document) into one file.
+
+        `stores` is consumed one document at a time, so it may be a generator.
+        """
+        merged = BM25Index()
+        chunk_docs = array("I")
+        chunk_ids = array("I")
+        for doc_no, stored in enumerate(stores):
+            base = len(merged.doc_lens)
+            for term, entries in stored.retriever.postings.items():
+                merged.postings.setdefault(term, []).extend(
+                    (base + chunk_id, tf) for chunk_id, tf in entries
+                )
+            merged.doc_lens.extend(stored.retriever.doc_lens)
+            merged.total_len += stored.retriever.total_len
+            chunk_docs.extend([doc_no] * stored.chunk_count)
+            chunk_ids.extend(range(stored.chunk_count))
+        vocab, flat = pack_postings(merged.postings)
+        arrays = [
+            ("doc_lens", array("I", merged.doc_lens)),
+            ("postings", array("I", flat)),
+            ("chunk_docs", chunk_docs),
+            ("chunk_ids", chunk_ids),
+        ]
+        header = {
+            "documents": documents,
+            "bm25": {"vocab": vocab, "total_len": merged.total_len, "k1": merged.k1, "b": merged.b},
+        }
+        write_index_file(path, arrays, header)
+
+
+class CorpusIndex:
+    """BM25 retrieval across every PDF in a library, with file/page provenance.
+
+    Each PDF keeps its own stored index (see IndexStore). Their postings are
+    merged into segments of up to `docs_per_segment` documents, each a
+    memory-mapped file under cache/corpus/ keyed by the documents it holds, so
+    adding or changing one PDF only rebuilds its segment. Queries score every
+    segment with corpus-wide statistics and merge the best hits. Chunk text
+    is read from the per-document indexes, at most `max_open` of which are
+    kept open, so memory grows with the vocabulary rather than the library.
+    """
+
+    def __init__(self, index_store, docs_per_segment=256, max_open=32):
+        self.index_store = index_store
+        self.docs_per_segment = docs_per_segment
+        self.max_open = max_open
+        self.segment_dir = os.path.join(index_store.cache_dir, "corpus")
+        self.segments = []
+        self.failed = []  # (file name, error message) of PDFs that could not be indexed
+        self._open = OrderedDict()  # index key -> StoredIndex, least recently used first
+
+    def __len__(self):
+        return sum(len(segment.retriever) for segment in self.segments)
+
+    @property
+    def files(self):
+        return [name for segment in self.segments for name, _ in segment.documents]
+
+    def build(self, indexer, file_paths, workers=None):
+        """Index any PDFs that have no stored index yet, then (re)open the segments.
+
+        Missing indexes are built by `workers` processes, one PDF per task;
+        `indexer` supplies the extraction settings, progress and cancellation.
+        """
+        workers = indexer.extract_workers if workers is None else workers
+        settings = indexer.extractor_settings()
+        documents, missing = [], []
+        self.failed = []
+        for path in sorted(file_paths, key=os.path.basename):
+            key = indexer.index_store.key_for(path, settings)
+            documents.append((os.path.basename(path), key))
+            if not os.path.exists(indexer.index_store.path_for(key)):
+                missing.append((path, key))
+
+        if missing:
+            logging.info(f"Indexing {len(missing)} of {len(documents)} PDFs")
+            for path, error in self._index_missing(indexer, missing, workers, settings):
+                logging.error(f"Failed to index {path}: {error}")
+                self.failed.append((os.path.basename(path), error))
+        failed = {name for name, _ in self.failed}
+        documents = [doc for doc in documents if doc[0] not in failed]
+
+        self.segments = []
+        self._open.clear()
+        for start in range(0, len(documents), self.docs_per_segment):
+            indexer.check_cancelled()
+            self.segments.append(self._segment(documents[start:start + self.docs_per_segment]))
+        self._prune_segments()
+        logging.info(f"Corpus ready: {len(documents)} PDFs, {len(self)} chunks "
+                     f"in {len(self.segments)} segments")
+        return self
+
+    def _index_missing(self, indexer, missing, workers, settings):
+        """Build stored indexes; yields (path, error message) for PDFs that failed."""
+        done = 0
+        indexer.report_progress(done, len(missing), "Indexing document")
+        if workers > 1 and len(missing) > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+                    worker = indexer.worker_copy()
+                    futures = {pool.submit(_index_document, worker, path, key): path
+                               for path, key in missing}
+                    try:
+                        for future in as_completed(futures):
+                            indexer.check_cancelled()
+                            path = futures[future]
+                            try:
+                                indexer.index_store.record_source(path, future.result(), settings)
+                            except BrokenProcessPool:
+                                raise
+                            except Exception as e:
+                                yield path, str(e)
+                            done += 1
+                            indexer.report_progress(done, len(missing), "Indexing document")
+                    finally:
+                        for future in futures:
+                            future.cancel()
+                return
+            except (OSError, BrokenProcessPool) as e:
+                logging.warning(f"Parallel indexing unavailable ({str(e)}), falling back to serial")
+                missing = [(path, key) for path, key in missing
+                           if not os.path.exists(indexer.index_store.path_for(key))]
+
+        for path, key in missing:
+            indexer.check_cancelled()
+            try:
+                indexer.load_index(path, key)
+                indexer.pdf_cache.pop(key, None)  # the corpus opens documents on demand
+                indexer.index_store.record_source(path, key, settings)
+            except Exception as e:
+                yield path, str(e)
+            done += 1
+            indexer.report_progress(done, len(missing), "Indexing document")
+
+    def _segment(self, documents):
+        blob = json.dumps(documents).encode("utf-8")
+        path = os.path.join(self.segment_dir, f"{hashlib.sha256(blob).hexdigest()}.idx")
+        if not os.path.exists(path):
+            logging.info(f"Merging {len(documents)} PDFs into {path}")
+            Segment.write(path, documents, (self._document(key) for _, key in documents))
+        return Segment(path)
+
+    def _prune_segments(self):
+        """Delete segment files no longer referenced by the current library."""
+        keep = {os.path.abspath(segment.path) for segment in self.segments}
+        for name in os.listdir(self.segment_dir) if os.path.isdir(self.segment_dir) else []:
+            path = os.path.abspath(os.path.join(self.segment_dir, name))
+            if name.endswith(".idx") and path not in keep:
+                os.remove(path)
+
+    def _document(self, key):
+        """The stored index for a document key, from a small LRU of open indexes."""
+        stored = self._open.pop(key, None) or self.index_store.load(key)
+        if stored is None:
+            raise ValueError(f"Index {key} is missing; rebuild the corpus")
+        self._open[key] = stored
+        while len(self._open) > self.max_open:
+            self._open.popitem(last=False)
+        return stored
+
+    def search(self, query, k=5, files=None):
+        """Return up to k CorpusHit(file, page, text, score), best first.
+
+        `files` limits the search to those PDF file names.
+        """
+        n = len(self)
+        if not n:
+            return []
+        avgdl = sum(segment.retriever.total_len for segment in self.segments) / n or 1.0
+        weights = {}
+        for term in set(tokenize(query)):
+            df = sum(segment.retriever.doc_freq(term) for segment in self.segments)
+            if df:
+                weights[term] = self.segments[0].retriever.idf(df, n)
+        wanted = set(files) if files else None
+
+        best = []  # (score, segment number, segment chunk id)
+        for seg_no, segment in enumerate(self.segments):
+            accept = None
+            if wanted is not None:
+                allowed = {i for i, (name, _) in enumerate(segment.documents) if name in wanted}
+                if not allowed:
+                    continue
+                accept = lambda chunk_id, docs=segment.chunk_docs, allowed=allowed: docs[chunk_id] in allowed
+            scores = segment.retriever.score(weights, avgdl, accept)
+            best.extend((score, seg_no, chunk_id) for chunk_id, score in
+                        heapq.nlargest(k, scores.items(), key=lambda item: item[1]))
+
+        hits = []
+        for score, seg_no, chunk_id in heapq.nlargest(k, best):
+            segment = self.segments[seg_no]
+            name, key = segment.documents[segment.chunk_docs[chunk_id]]
+            record = self._document(key).chunk_record(segment.chunk_ids[chunk_id])
+            hits.append(CorpusHit(name, record.page, record.text, score))
+        return hits
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+
+from model_host import MODEL_DIR
+
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2.gguf2.f16.gguf"
+
+
+def load_embedder():
+    """Load the GPT4All sentence-embedding model from models/ in offline mode."""
+    from gpt4all import Embed4All
+    path = os.path.join(MODEL_DIR, EMBED_MODEL_NAME)
+    if not os.path.exists(path):
+        raise RuntimeError(f"Embedding model not found at: {path}")
+    return Embed4All(EMBED_MODEL_NAME, model_path=MODEL_DIR + "/", allow_download=False)
+
+
+def normalize_rows(matrix):
+    """Scale rows to unit length so a dot product is the cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def embed_texts(embedder, texts, batch_size=64, on_batch=None):
+    """Embed texts in batches; returns a unit-normalized float32 matrix.
+
+    on_batch(done) is called after each batch (progress, cancellation).
+    """
+    rows = []
+    for start in range(0, len(texts), batch_size):
+        rows.extend(embedder.embed(list(texts[start:start + batch_size])))
+        if on_batch:
+            on_batch(min(start + batch_size, len(texts)))
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32)
+    return normalize_rows(rows)
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first, without a full sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    idx = np.argpartition(scores, -k)[-k:]
+    return idx[np.argsort(scores[idx])[::-1]]
+
+
+class VectorIndex:
+    """Dense retrieval over a (chunks x dims) float32 matrix of unit vectors.
+
+    The matrix is usually memory-mapped from cache/ (see IndexStore.load_vectors).
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def scores(self, query_vectors):
+        """Cosine similarity of each query row against every chunk, in one matmul."""
+        return np.atleast_2d(query_vectors) @ self.matrix.T
+
+    def search(self, query_vector, k=5):
+        """Return up to k (chunk_id, score) pairs, best match first."""
+        return self.search_many(query_vector, k)[0]
+
+    def search_many(self, query_vectors, k=5):
+        """Top k (chunk_id, score) pairs for each query row."""
+        if not len(self.matrix):
+            return [[] for _ in np.atleast_2d(query_vectors)]
+        results = []
+        for row in self.scores(query_vectors):
+            results.append([(int(i), float(row[i])) for i in top_k(row, k)])
+        return results
+
+
+def fuse_scores(keyword, vector, weight=0.5):
+    """Blend keyword (BM25) and vector scores for the same chunks.
+
+    Both inputs map chunk_id -> score; each is min-max normalized over its
+    candidates so neither scale dominates, and weight is the share given to
+    the vector score. Returns (chunk_id, score) pairs, best first.
+    """
+    def normalized(scores):
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        span = high - low
+        return {i: (s - low) / span if span else 1.0 for i, s in scores.items()}
+
+    keyword, vector = normalized(keyword), normalized(vector)
+    fused = {i: (1 - weight) * keyword.get(i, 0.0) + weight * vector.get(i, 0.0)
+             for i in keyword.keys() | vector.keys()}
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
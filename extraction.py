@@ -0,0 +1,250 @@
+import re
+import time
+import hashlib
+import logging
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+
+# Render settings for scanned pages; 72 dpi matches fitz's get_pixmap() default
+DEFAULT_DPI = 72
+DEFAULT_GRAYSCALE = True
+
+
+# Indirect references ("12 0 R") in PDF object source, and /Parent links up the page or form tree
+PDF_REFERENCE = re.compile(r"(\d+) (\d+) R\b")
+PDF_PARENT = re.compile(r"/Parent\s*\d+ \d+ R\b")
+
+# Page triage runs on a copy scaled down to this many pixels on the long side
+TRIAGE_SIZE = 512
+# More text regions than this are OCR'd as one crop, as each Tesseract call has a fixed cost
+MAX_REGIONS = 8
+
+# Tesseract page segmentation modes (--psm) used per region type
+PSM_AUTO = 3    # large areas that may hold columns, headings and figures
+PSM_BLOCK = 6   # a single block of lines
+PSM_LINE = 7    # a single line, e.g. a caption or a label
+
+
+def triage_page(gray):
+    """Classify a grayscale page image and find the regions worth running OCR on.
+
+    Cheap, vectorized checks on a downscaled copy: ink is joined into
+    clusters, mid-tone coverage separates photographs from printed text, and
+    the row projection profile of each cluster counts its text lines. A page
+    is blank only when it has no cluster bigger than a speck, so a lone
+    heading or formula line still gets OCR'd. Returns (kind, regions): kind is "blank", "picture" or "text" and
+    regions are (x, y, w, h, psm) boxes in gray's coordinates, in reading order.
+    """
+    height, width = gray.shape
+    scale = min(1.0, TRIAGE_SIZE / max(height, width))
+    small = gray
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    if int(small.max()) - int(small.min()) < 32:
+        return "blank", []
+    _, ink = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+
+    # Join letters into words and lines into blocks; clusters are candidate regions
+    gap = max(3, small.shape[1] // 80)
+    blobs = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (gap + 1, 2 * gap + 1)))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(blobs, connectivity=8)
+    midtone = (small > 64) & (small < 192)
+
+    regions = []
+    marks = 0  # clusters bigger than specks, text or not
+    for x, y, w, h, _ in stats[1:count]:
+        if w < 2 * gap or h < 3:
+            continue  # specks
+        marks += 1
+        box_ink = ink[y:y + h, x:x + w]
+        fill = box_ink.mean()
+        if fill > 0.45 or midtone[y:y + h, x:x + w].mean() > 0.35:
+            continue  # solid or shaded areas: photographs, filled shapes
+        rows = box_ink.any(axis=1)
+        lines = int(np.count_nonzero(rows[1:] & ~rows[:-1]) + rows[0])  # runs of inked rows
+        line_height = np.count_nonzero(rows) / max(lines, 1)
+        if line_height > 0.1 * small.shape[0] or line_height < 2:
+            continue  # tall strokes with no line structure: drawings, rules
+        if lines == 1 and w < 2 * line_height:
+            continue  # an isolated mark rather than a line of text
+        psm = PSM_LINE if lines == 1 else PSM_BLOCK
+        if w * h > 0.4 * small.shape[0] * small.shape[1]:
+            psm = PSM_AUTO
+        regions.append((x, y, w, h, psm))
+
+    if not regions:
+        return ("picture" if marks else "blank"), []
+    if len(regions) > MAX_REGIONS:
+        x0 = min(r[0] for r in regions)
+        y0 = min(r[1] for r in regions)
+        x1 = max(r[0] + r[2] for r in regions)
+        y1 = max(r[1] + r[3] for r in regions)
+        regions = [(x0, y0, x1 - x0, y1 - y0, PSM_AUTO)]
+
+    # Reading order: top to bottom, and left to right among regions starting at about the same height
+    ordered = []
+    for region in sorted(regions, key=lambda r: r[1]):
+        if ordered and region[1] - ordered[-1][0][1] <= 2 * gap:
+            ordered[-1].append(region)
+        else:
+            ordered.append([region])
+    regions = [region for row in ordered for region in sorted(row, key=lambda r: r[0])]
+
+    pad = gap
+    boxes = []
+    for x, y, w, h, psm in regions:
+        x0 = max(0, int((x - pad) / scale))
+        y0 = max(0, int((y - pad) / scale))
+        x1 = min(width, int((x + w + pad) / scale) + 1)
+        y1 = min(height, int((y + h + pad) / scale) + 1)
+        boxes.append((x0, y0, x1 - x0, y1 - y0, psm))
+    return "text", boxes
+
+
+def classify_image(gray):
+    """Rough image type from the number of outlines in a downscaled edge map."""
+    scale = min(1.0, TRIAGE_SIZE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(gray, 100, 200)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) > 20:
+        return "Graph/Chart", len(contours)
+    if len(contours) > 5:
+        return "Diagram", len(contours)
+    return "Picture", len(contours)
+
+
+def analyze_image(image, page_num, color_order="BGR"):
+    """Analyze image content and extract information.
+
+    `image` may already be single-channel, in which case no conversion is done.
+    Tesseract only runs on the text regions found by triage_page, so blank
+    pages and pure pictures cost a few milliseconds instead of a full OCR pass.
+    """
+    try:
+        # Convert to grayscale for better processing
+        if image.ndim == 2:
+            gray = image
+        elif color_order == "RGB":
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        kind, regions = triage_page(gray)
+        if kind == "blank":
+            return {'type': "Blank", 'text': "", 'page': page_num, 'complexity': 0}
+
+        # Extract text using OCR, one call per region with a layout mode to match
+        texts = []
+        for x, y, w, h, psm in regions:
+            text = pytesseract.image_to_string(gray[y:y + h, x:x + w], config=f"--psm {psm}")
+            if text.strip():
+                texts.append(text.strip())
+
+        image_type, complexity = classify_image(gray)
+        return {
+            'type': image_type,
+            'text': "\n\n".join(texts),
+            'page': page_num,
+            'complexity': complexity
+        }
+    except Exception as e:
+        logging.error(f"Image analysis failed: {str(e)}")
+        return None
+
+
+def pixmap_to_array(pix):
+    """View a pixmap's sample buffer as a uint8 array without copying.
+
+    The array borrows the pixmap's memory, so keep `pix` alive while using it.
+    """
+    samples = getattr(pix, "samples_mv", None)
+    if samples is None:  # older PyMuPDF: bytes copy, still no disk round trip
+        samples = pix.samples
+    image = np.ndarray(
+        (pix.height, pix.width, pix.n),
+        dtype=np.uint8,
+        buffer=samples,
+        strides=(pix.stride, pix.n, 1),
+    )
+    return image[:, :, 0] if pix.n == 1 else image
+
+
+def extract_text_from_image_page(page, dpi=DEFAULT_DPI, grayscale=DEFAULT_GRAYSCALE):
+    """Extract text from a PDF page containing images."""
+    try:
+        colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+        pix = page.get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+        img = pixmap_to_array(pix)
+
+        analysis = analyze_image(img, page.number + 1, color_order="RGB")
+        if analysis and analysis['text']:
+            return f"""
+Page {analysis['page']} Image Analysis:
+Type: {analysis['type']}
+Text Content: {analysis['text']}
+"""
+        return ""
+
+    except Exception as e:
+        logging.error(f"Error processing image page: {str(e)}")
+        return ""
+
+
+def page_fingerprint(doc, page):
+    """SHA-256 over a page's geometry and every PDF object it draws from.
+
+    Follows references out of the page object recursively, so content
+    streams, fonts, images and Form XObjects (with their own resources) are
+    all covered, as are resources inherited from the page tree. Other pages
+    and the page tree itself are left out.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.rect), page.rotation)).encode("utf-8"))
+    pending = [page.xref]
+    # Pages may inherit /Resources from an ancestor in the page tree
+    node = page.xref
+    while doc.xref_get_key(node, "Resources")[0] == "null":
+        kind, parent = doc.xref_get_key(node, "Parent")
+        if kind != "xref":
+            break
+        node = int(parent.split()[0])
+        kind, resources = doc.xref_get_key(node, "Resources")
+        if kind != "null":
+            digest.update(resources.encode("utf-8"))
+            pending.extend(int(xref) for xref, _ in PDF_REFERENCE.findall(resources))
+    seen = set()
+    while pending:
+        xref = pending.pop()
+        if xref in seen or xref <= 0 or xref >= doc.xref_length():
+            continue
+        seen.add(xref)
+        if xref != page.xref and doc.xref_get_key(xref, "Type")[1] in ("/Page", "/Pages"):
+            continue  # e.g. a link destination or an annotation's /P
+        source = PDF_PARENT.sub("", doc.xref_object(xref, compressed=True))
+        digest.update(f"{xref}:{source}".encode("utf-8"))
+        if doc.xref_is_stream(xref):
+            digest.update(doc.xref_stream_raw(xref) or b"")
+        pending.extend(reversed([int(ref) for ref, _ in PDF_REFERENCE.findall(source)]))
+    return digest.digest()
+
+
+def ocr_pages(file_path, page_numbers, dpi=DEFAULT_DPI, grayscale=DEFAULT_GRAYSCALE):
+    """Process-pool worker: open the PDF independently and OCR the given pages.
+
+    Returns (page_no, text, seconds) per page; the timing is reported back
+    because metrics recorded in a worker process would be lost.
+    """
+    results = []
+    with fitz.open(file_path) as doc:
+        for page_no in page_numbers:
+            start = time.perf_counter()
+            text = extract_text_from_image_page(doc[page_no], dpi, grayscale)
+            results.append((page_no, text, time.perf_counter() - start))
+    return results
@@ -0,0 +1,75 @@
+import re
+
+# Words that don't distinguish one formula from another
+FILLER_WORDS = frozenset(['the', 'a', 'an', 'of', 'for', 'to', 'in', 'on', 'is', 'what',
+                          'formula', 'equation', 'find', 'calculate'])
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def canonical_tokens(text):
+    """Order-free key tokens: lowercase, no punctuation/possessives/plurals/filler."""
+    tokens = set()
+    for word in WORD_RE.findall(text.lower().replace("'s", "")):
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.add(word)
+    return frozenset(tokens)
+
+
+def char_ngrams(tokens, n=3):
+    text = f" {' '.join(sorted(tokens))} "
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class FormulaIndex:
+    """Fuzzy lookup of stored formula keys.
+
+    Queries match a stored key when their token sets are equal ("law of ohm"
+    vs "ohm's law"), or when the mean of token-set Jaccard and character
+    trigram Dice similarity reaches `threshold`.
+    """
+
+    def __init__(self, keys=(), threshold=0.75):
+        self.threshold = threshold
+        self.by_tokens = {}  # canonical token set -> stored key
+        self.grams = {}  # stored key -> trigram set
+        self.gram_postings = {}  # trigram -> stored keys containing it
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        tokens = canonical_tokens(key)
+        if not tokens:
+            return
+        self.by_tokens.setdefault(tokens, key)
+        grams = char_ngrams(tokens)
+        self.grams[key] = grams
+        for gram in grams:
+            self.gram_postings.setdefault(gram, set()).add(key)
+
+    def lookup(self, query):
+        """Return (stored_key, similarity) for the best match, or None."""
+        tokens = canonical_tokens(query)
+        if not tokens:
+            return None
+        if tokens in self.by_tokens:
+            return self.by_tokens[tokens], 1.0
+
+        grams = char_ngrams(tokens)
+        candidates = set()
+        for gram in grams:
+            candidates |= self.gram_postings.get(gram, set())
+
+        best = None
+        for key in candidates:
+            key_tokens = canonical_tokens(key)
+            key_grams = self.grams[key]
+            jaccard = len(tokens & key_tokens) / len(tokens | key_tokens)
+            dice = 2 * len(grams & key_grams) / (len(grams) + len(key_grams))
+            score = (jaccard + dice) / 2
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+
+class FormulaStore:
+    """formulas.json snapshot plus an append-only JSONL log of new entries.
+
+    New formulas cost one appended line instead of a full rewrite. Every
+    `compact_every` appends the log is folded into a fresh snapshot written to
+    a temp file and renamed over the old one, so the snapshot is never
+    half-written. Startup loads the snapshot and replays the log on top.
+    """
+
+    def __init__(self, path="formulas.json", log_path=None, compact_every=50):
+        self.path = path
+        self.log_path = log_path or os.path.splitext(path)[0] + ".wal.jsonl"
+        self.compact_every = compact_every
+        self.formulas = {}
+        self.pending = 0  # log entries not yet folded into the snapshot
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the snapshot, replay the log, and return the formulas dict."""
+        self.formulas = self.load_snapshot()
+        self.pending = self.replay_log()
+        if self.pending >= self.compact_every:
+            self.compact()
+        return self.formulas
+
+    def load_snapshot(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Check if the "formulas" key exists and is a dictionary
+            if not isinstance(data.get("formulas", {}), dict):
+                raise ValueError("Invalid structure: 'formulas' key is not a dictionary.")
+            logging.info("JSON file is valid.")
+            return data.get("formulas", {})
+        except (json.JSONDecodeError, ValueError, UnicodeDecodeError, AttributeError) as e:
+            # Keep the damaged file for recovery instead of overwriting it
+            backup = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup)
+            logging.error(f"Invalid JSON file: {str(e)}. Moved it to {backup} and starting empty.")
+            return {}
+
+    def replay_log(self):
+        """Apply logged entries to self.formulas and return how many were applied."""
+        if not os.path.exists(self.log_path):
+            return 0
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        if data and not data.endswith(b"\n"):
+            # A crash mid-append left a torn last line; drop it so new appends start clean
+            data = data[:data.rfind(b"\n") + 1]
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(len(data))
+            logging.warning(f"Discarded a partially written entry at the end of {self.log_path}")
+        applied = 0
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            try:
+                entry = json.loads(line)
+                self.formulas[entry["key"]] = entry["value"]
+                applied += 1
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                logging.warning(f"Skipping bad formula log entry: {str(e)}")
+        return applied
+
+    def put(self, key, value):
+        """Durably append one formula; compacts the log every compact_every entries.
+
+        The formula is in self.formulas even if the append fails (and raises),
+        so it is still served until the process exits.
+        """
+        line = json.dumps({"key": key, "value": value}) + "\n"
+        with self._lock:
+            self.formulas[key] = value
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending += 1
+            if self.pending >= self.compact_every:
+                self._compact()
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"formulas": self.formulas}, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Entries are now in the snapshot; replaying them again would be harmless
+        with open(self.log_path, 'w', encoding='utf-8'):
+            pass
+        self.pending = 0
+        logging.info(f"Compacted formula log into {self.path}")
@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, messagebox
 from main import StudyBot
+from jobs import JobRunner, JobCancelled
 import os
 import logging
 import fitz  # PyMuPDF
@@ -19,11 +20,13 @@ class StudyBotGUI:
         self.selected_file = None
         self.indepth_completed = False
 
-        # Initialize bot
+        # Initialize bot; its work runs on a background worker thread
         self.bot = StudyBot()
+        self.jobs = JobRunner(self.root)
         self.bot.set_callbacks(
-            status_cb=self.update_status,
-            progress_cb=self.update_progress
+            status_cb=lambda message: self.jobs.post(self.update_status, message),
+            progress_cb=lambda value: self.jobs.post(self.update_progress, value),
+            cancel_cb=self.jobs.is_cancelled
         )
         
         self.setup_styles()
@@ -101,6 +104,10 @@ class StudyBotGUI:
                                   relief=tk.FLAT, padx=20)
         self.submit_btn.pack(side=tk.LEFT)
 
+        self.cancel_btn = ttk.Button(query_frame, text="⏹ Cancel", command=self.cancel_query,
+                                     state="disabled")
+        self.cancel_btn.pack(side=tk.LEFT, padx=(5, 0))
+
         # Output area
         output_frame = ttk.LabelFrame(main_container, text="Response", padding="5")
         output_frame.pack(fill=tk.BOTH, expand=True)
@@ -126,6 +133,9 @@ class StudyBotGUI:
         )
         self.export_btn.pack(side=tk.RIGHT)
 
+        self.stats_btn = ttk.Button(export_frame, text="📊 Stats", command=self.show_stats)
+        self.stats_btn.pack(side=tk.RIGHT, padx=(0, 5))
+
         # Add progress bar
         self.progress_frame = ttk.Frame(main_container)
         self.progress_frame.pack(fill=tk.X, pady=(0, 5))
@@ -239,93 +249,113 @@ class StudyBotGUI:
             self.file_button.config(state="disabled")
 
     def handle_query(self):
+        if self.jobs.busy:
+            return  # Submit is disabled while a job runs; this also covers <Return>
         query = self.query_entry.get().strip()
         mode = self.mode_var.get()
-        
-        self.output_box.delete(1.0, tk.END)
         self.status_var.set("Processing...")
-        self.root.update_idletasks()
 
         try:
-            # Show progress bar for lengthy operations
-            self.progress_frame.pack(fill=tk.X, pady=(0, 5))
-            
-            if mode == "index":
-                if not self.selected_file and not self.indepth_completed:
-                    raise ValueError("Please select a PDF file for in-depth study")
-                    
-                if not self.indepth_completed:
-                    # Indexing phase
-                    pdf_path = os.path.join(os.path.abspath("documents"), self.selected_file)
-                    if not os.path.exists(pdf_path):
-                        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-                        
-                    self.status_var.set("Indexing PDF... This may take a while.")
-                    self.root.update_idletasks()
-                    
-                    result = self.bot.index_chapter(pdf_path)
+            work, on_done = self.prepare_job(mode, query)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            self.status_var.set("Error occurred.")
+            logging.error(f"Error in handle_query: {str(e)}")
+            return
+
+        self.output_box.delete(1.0, tk.END)
+        self.progress_var.set(0)
+        # Show progress bar for lengthy operations
+        self.progress_frame.pack(fill=tk.X, pady=(0, 5))
+        self.submit_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+
+        def done():
+            on_done()
+            self.finish_job()
+
+        self.jobs.submit(work, on_token=self.append_output, on_done=done, on_error=self.job_failed)
+
+    def prepare_job(self, mode, query):
+        """Validate input on the UI thread and return (work, on_done) for the worker.
+
+        `work` runs on the worker thread and returns a string or a token stream.
+        """
+        def finished():
+            self.status_var.set("Done.")
+
+        if mode == "index":
+            if not self.selected_file and not self.indepth_completed:
+                raise ValueError("Please select a PDF file for in-depth study")
+
+            if not self.indepth_completed:
+                # Indexing phase
+                pdf_path = os.path.join(os.path.abspath("documents"), self.selected_file)
+                if not os.path.exists(pdf_path):
+                    raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+
+                self.status_var.set("Indexing PDF... This may take a while.")
+
+                def indexed():
                     self.indepth_completed = True
-                    
                     self.status_var.set("In-depth study completed. You can now ask detailed questions.")
                     self.update_interface()
                     self.query_entry.config(state="normal")  # Enable query entry
-                else:
-                    # Query phase
-                    if not query or query == "Enter question for detailed study...":
-                        raise ValueError("Please enter your question")
-                    result = self.bot.indepth_query(query)
-                    
-                self.output_box.insert(tk.END, result)
-                
-            else:
-                result = ""
-                if mode == "ask":
-                    if not query or query == "Enter formula query...":
-                        raise ValueError("Please enter a formula query")
-                    result = self.bot.get_formula(query)
-                elif mode == "search":
-                    if not query or query == "Enter any question...":
-                        raise ValueError("Please enter a question")
-                    result = self.bot.search_query(query)
-                elif mode == "pdf":
-                    if not self.selected_file:
-                        raise ValueError("Please select a PDF file")
-                    if not query or query == "Enter question about the PDF...":
-                        raise ValueError("Please enter a question")
-                    # Use full path for PDF operations
-                    pdf_path = os.path.join(os.path.abspath("documents"), self.selected_file)
-                    if not os.path.exists(pdf_path):
-                        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-                    result = self.bot.query_pdf(pdf_path, query)
-                elif mode == "index":
-                    if not self.selected_file and not self.indepth_completed:
-                        raise ValueError("Please select a PDF file for in-depth study")
-                    if not self.indepth_completed:
-                        # Use full path for indexing
-                        pdf_path = os.path.join(os.path.abspath("documents"), self.selected_file)
-                        if not os.path.exists(pdf_path):
-                            raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-                        result = self.bot.index_chapter(pdf_path)
-                        self.indepth_completed = True
-                        self.status_var.set("In-depth study completed. You can now ask detailed questions.")
-                        self.update_interface()
-                    elif query and query != "Enter question for detailed study...":
-                        result = self.bot.indepth_query(query)
-                elif mode == "summary":
-                    if not self.indepth_completed:
-                        raise ValueError("Please perform In-depth Study first")
-                    result = self.bot.summarize_chapter()
-        
-                self.output_box.insert(tk.END, result)
-                if mode != "index" or (mode == "index" and self.indepth_completed):
-                    self.status_var.set("Done.")
-            
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+
+                return (lambda: self.bot.index_chapter(pdf_path)), indexed
+
+            # Query phase
+            if not query or query == "Enter question for detailed study...":
+                raise ValueError("Please enter your question")
+            return (lambda: self.bot.indepth_query_stream(query)), finished
+
+        if mode == "ask":
+            if not query or query == "Enter formula query...":
+                raise ValueError("Please enter a formula query")
+            return (lambda: self.bot.get_formula_stream(query)), finished
+        if mode == "search":
+            if not query or query == "Enter any question...":
+                raise ValueError("Please enter a question")
+            return (lambda: self.bot.search_query_stream(query)), finished
+        if mode == "pdf":
+            if not self.selected_file:
+                raise ValueError("Please select a PDF file")
+            if not query or query == "Enter question about the PDF...":
+                raise ValueError("Please enter a question")
+            # Use full path for PDF operations
+            pdf_path = os.path.join(os.path.abspath("documents"), self.selected_file)
+            if not os.path.exists(pdf_path):
+                raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+            return (lambda: self.bot.query_pdf_stream(pdf_path, query)), finished
+        if mode == "summary":
+            if not self.indepth_completed:
+                raise ValueError("Please perform In-depth Study first")
+            return self.bot.summarize_chapter_stream, finished
+        raise ValueError(f"Unknown mode: {mode}")
+
+    def append_output(self, token):
+        """Append streamed text to the output box as it arrives."""
+        self.output_box.insert(tk.END, token)
+        self.output_box.see(tk.END)
+
+    def job_failed(self, error):
+        if isinstance(error, JobCancelled):
+            self.status_var.set("Cancelled.")
+        else:
+            messagebox.showerror("Error", str(error))
             self.status_var.set("Error occurred.")
-            logging.error(f"Error in handle_query: {str(e)}")
-        finally:
-            self.progress_frame.pack_forget()  # Hide progress bar
+            logging.error(f"Error in handle_query: {str(error)}")
+        self.finish_job()
+
+    def finish_job(self):
+        self.progress_frame.pack_forget()  # Hide progress bar
+        self.submit_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+
+    def cancel_query(self):
+        """Stop the running OCR or generation job."""
+        self.jobs.cancel()
+        self.status_var.set("Cancelling...")
 
     def list_pdfs(self):
         files = self.bot.list_files()
@@ -360,15 +390,33 @@ class StudyBotGUI:
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to export: {str(e)}")
 
+    def show_stats(self):
+        """Open a window with stage timings and cache hit rates, refreshed every 2 seconds."""
+        window = tk.Toplevel(self.root)
+        window.title("📊 StudyBot Stats")
+        window.geometry("760x420")
+        stats_box = scrolledtext.ScrolledText(window, wrap=tk.NONE, font=("Consolas", 10))
+        stats_box.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        def refresh():
+            stats_box.delete(1.0, tk.END)
+            stats_box.insert(tk.END, self.bot.stats_report())
+
+        def tick():
+            if window.winfo_exists():
+                refresh()
+                window.after(2000, tick)
+
+        ttk.Button(window, text="🔄 Refresh", command=refresh).pack(side=tk.BOTTOM, pady=(0, 5))
+        tick()
+
     def update_status(self, message):
         """Update status bar with message."""
         self.status_var.set(message)
-        self.root.update_idletasks()
 
     def update_progress(self, value):
         """Update progress bar."""
         self.progress_var.set(value)
-        self.root.update_idletasks()
 
     def update_counts(self, event=None):
         """Update word and character counts."""
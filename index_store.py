@@ -0,0 +1,272 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import tempfile
+from array import array
+
+import numpy as np
+
+from chunking import Chunk
+from retrieval import BM25Index, pack_postings
+
+MAGIC = b"SBIX"
+FORMAT_VERSION = 3
+PREAMBLE = struct.Struct("<4sII")  # magic, format version, header length
+
+
+def _align(offset, size=8):
+    return (offset + size - 1) // size * size
+
+
+def open_index_file(path):
+    """Map an index file; returns (mmap, header dict, {section name: memoryview})."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_len = PREAMBLE.unpack_from(mm, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        mm.close()
+        raise ValueError(f"Unsupported index file: {path}")
+    header = json.loads(mm[PREAMBLE.size:PREAMBLE.size + header_len])
+    view = memoryview(mm)
+    sections = {}
+    for name, (offset, length, typecode) in header["sections"].items():
+        sections[name] = view[offset:offset + length].cast(typecode)
+    return mm, header, sections
+
+
+def write_index_file(path, arrays, header):
+    """Atomically write named arrays (array.array or bytes) after a JSON header.
+
+    Each section starts on an 8-byte boundary so it can be cast in place
+    from the memory map; `header` gains a "sections" table of
+    (offset, length, typecode).
+    """
+    def build_header(base):
+        sections = {}
+        offset = base
+        for name, arr in arrays:
+            typecode = getattr(arr, "typecode", "B")
+            size = len(arr) * getattr(arr, "itemsize", 1)
+            sections[name] = (offset, size, typecode)
+            offset = _align(offset + size)
+        return json.dumps(dict(header, sections=sections)).encode("utf-8")
+
+    # Section offsets depend on the header length, so size it first
+    header_bytes = build_header(0)
+    while True:
+        candidate = build_header(_align(PREAMBLE.size + len(header_bytes)))
+        if len(candidate) == len(header_bytes):
+            header_bytes = candidate
+            break
+        header_bytes = candidate
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            for _, arr in arrays:
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                f.write(arr)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class StoredIndex:
+    """A chapter index opened from disk; arrays and text stay memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        self.key = os.path.splitext(os.path.basename(path))[0]
+        self._mm, self.header, sections = open_index_file(path)
+        self._text = sections["text"]
+        self._page_offsets = sections["page_offsets"]
+        self._chunk_offsets = sections["chunk_offsets"]
+        self._chunk_meta = sections["chunk_meta"]  # (page, offset) pairs
+        self._fingerprints = sections["page_fingerprints"]  # 32 bytes per page
+        bm25 = self.header["bm25"]
+        self.retriever = BM25Index.from_packed(
+            {term: tuple(entry) for term, entry in bm25["vocab"].items()},
+            sections["postings"],
+            sections["doc_lens"],
+            bm25["total_len"],
+            k1=bm25["k1"],
+            b=bm25["b"],
+        )
+
+    @property
+    def page_count(self):
+        return len(self._page_offsets) - 1
+
+    @property
+    def chunk_count(self):
+        return len(self._chunk_offsets) - 1
+
+    def _slice(self, offsets, i):
+        return bytes(self._text[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def page_text(self, i):
+        return self._slice(self._page_offsets, i)
+
+    def pages(self):
+        return [self.page_text(i) for i in range(self.page_count)]
+
+    def page_fingerprint(self, i):
+        return bytes(self._fingerprints[32 * i:32 * (i + 1)])
+
+    def chunk(self, i):
+        return self._slice(self._chunk_offsets, i)
+
+    def chunks(self):
+        return [self.chunk(i) for i in range(self.chunk_count)]
+
+    def chunk_record(self, i):
+        """The chunk with its page/offset provenance, as a chunking.Chunk."""
+        return Chunk(self.chunk(i), self._chunk_meta[2 * i], self._chunk_meta[2 * i + 1])
+
+    def chunk_records(self):
+        return [self.chunk_record(i) for i in range(self.chunk_count)]
+
+
+class IndexStore:
+    """Persistent chapter indexes under cache/, keyed by PDF content hash."""
+
+    def __init__(self, cache_dir="cache"):
+        self.cache_dir = cache_dir
+        self._key_memo = {}  # (path, mtime, size) -> key, avoids re-hashing in one session
+        self.sources_path = os.path.join(cache_dir, "sources.json")
+
+    def key_for(self, file_path, settings):
+        """SHA-256 of the PDF bytes plus the extractor settings."""
+        st = os.stat(file_path)
+        settings_blob = json.dumps(settings, sort_keys=True)
+        memo_key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size, settings_blob)
+        if memo_key in self._key_memo:
+            return self._key_memo[memo_key]
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(settings_blob.encode("utf-8"))
+        key = digest.hexdigest()
+        self._key_memo[memo_key] = key
+        return key
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.idx")
+
+    def load(self, key):
+        """Open a stored index, or return None if there is none (or it is unreadable)."""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return StoredIndex(path)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logging.warning(f"Ignoring unreadable index {path}: {str(e)}")
+            return None
+
+    def record_source(self, file_path, key, settings):
+        """Remember which index was last built for a PDF path (for incremental re-indexing)."""
+        sources = self._read_sources()
+        sources[os.path.abspath(file_path)] = {"key": key, "settings": settings}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(sources, f, indent=2)
+        os.replace(tmp_path, self.sources_path)
+
+    def previous_index(self, file_path, settings):
+        """The last index built for this path with the same settings, if still on disk."""
+        entry = self._read_sources().get(os.path.abspath(file_path))
+        if not entry or entry.get("settings") != settings:
+            return None
+        return self.load(entry["key"])
+
+    def _read_sources(self):
+        try:
+            with open(self.sources_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, key, pages, chunks, retriever, fingerprints):
+        """Write pages, chunks (chunking.Chunk), page fingerprints and BM25 arrays
+        to one file and reopen it."""
+        text = bytearray()
+        page_offsets = array("Q", [0])
+        for page in pages:
+            text += page.encode("utf-8")
+            page_offsets.append(len(text))
+        chunk_offsets = array("Q", [len(text)])
+        chunk_meta = array("I")
+        for chunk in chunks:
+            text += chunk.text.encode("utf-8")
+            chunk_offsets.append(len(text))
+            chunk_meta.append(chunk.page)
+            chunk_meta.append(chunk.offset)
+        vocab, flat = pack_postings(retriever.postings)
+        arrays = [
+            ("page_offsets", page_offsets),
+            ("chunk_offsets", chunk_offsets),
+            ("chunk_meta", chunk_meta),
+            ("doc_lens", array("I", retriever.doc_lens)),
+            ("postings", array("I", flat)),
+            ("page_fingerprints", array("B", b"".join(fingerprints))),
+            ("text", text),
+        ]
+        header = {"bm25": {"vocab": vocab, "total_len": retriever.total_len,
+                           "k1": retriever.k1, "b": retriever.b}}
+        write_index_file(self.path_for(key), arrays, header)
+        logging.info(f"Saved index to {self.path_for(key)}")
+        return StoredIndex(self.path_for(key))
+
+    def summaries_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.summaries.json")
+
+    def load_summaries(self, key):
+        """Cached partial summaries for an index: prompt hash -> summary text."""
+        try:
+            with open(self.summaries_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_summaries(self, key, summaries):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(summaries, f)
+        os.replace(tmp_path, self.summaries_path(key))
+
+    def vectors_path(self, key, model_name):
+        tag = hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"{key}.{tag}.vec.npy")
+
+    def load_vectors(self, key, model_name):
+        """Memory-map the chunk embedding matrix for an index, or None if there is none."""
+        path = self.vectors_path(key, model_name)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable vectors {path}: {str(e)}")
+            return None
+
+    def save_vectors(self, key, model_name, matrix):
+        """Write a contiguous float32 matrix and reopen it memory-mapped."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(tmp_path, self.vectors_path(key, model_name))
+        return self.load_vectors(key, model_name)
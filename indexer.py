@@ -0,0 +1,286 @@
+import os
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+
+import extraction
+from jobs import JobCancelled
+from retrieval import BM25Index
+from chunking import iter_chunks
+from index_store import IndexStore
+from metrics import metrics
+
+# Text-layer pages of one PDF and a BM25 index over them (page i is doc i)
+PageIndex = namedtuple("PageIndex", "pages retriever")
+
+
+class DocumentIndexer:
+    """Extracts, chunks and indexes PDFs into an IndexStore.
+
+    Holds no model, so copies of it can build indexes in worker processes
+    (see corpus.py). StudyBot inherits the pipeline from here.
+    """
+
+    def __init__(self, cache_dir="cache"):
+        self.status_callback = None
+        self.progress_callback = None
+        self.cancel_callback = None
+        self.pdf_cache = {}  # cache key -> StoredIndex opened this session
+        self.index_store = IndexStore(cache_dir)
+        self.chunk_size = 1000
+        self.chunk_overlap = 0
+        self.chunk_boundary = "paragraph"
+        self.extract_workers = os.cpu_count() or 1
+        self.ocr_dpi = extraction.DEFAULT_DPI
+        self.ocr_grayscale = extraction.DEFAULT_GRAYSCALE
+        self.page_indexes = OrderedDict()  # (path, mtime, size) -> PageIndex, least recently used first
+        self.max_page_indexes = 8
+        self._page_index_lock = threading.Lock()  # page_indexes is shared by server request threads
+
+    def __getstate__(self):
+        # Locks don't pickle; worker copies sent to other processes get their own
+        state = dict(self.__dict__)
+        del state["_page_index_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._page_index_lock = threading.Lock()
+
+    def worker_copy(self, extract_workers=1):
+        """A picklable indexer with the same settings and no callbacks."""
+        copy = DocumentIndexer(self.index_store.cache_dir)
+        for name in ("chunk_size", "chunk_overlap", "chunk_boundary", "ocr_dpi", "ocr_grayscale"):
+            setattr(copy, name, getattr(self, name))
+        copy.extract_workers = extract_workers
+        return copy
+
+    def set_callbacks(self, status_cb=None, progress_cb=None, cancel_cb=None):
+        """Set callback functions for status and progress updates.
+
+        cancel_cb() should return True once the current operation ought to stop.
+        """
+        self.status_callback = status_cb
+        self.progress_callback = progress_cb
+        self.cancel_callback = cancel_cb
+
+    def is_cancelled(self):
+        return bool(self.cancel_callback and self.cancel_callback())
+
+    def check_cancelled(self):
+        """Raise JobCancelled if the caller has asked the current operation to stop."""
+        if self.is_cancelled():
+            raise JobCancelled("Cancelled")
+
+    def update_status(self, message):
+        """Update status if callback is set."""
+        if self.status_callback:
+            self.status_callback(message)
+
+    def analyze_image(self, image, page_num):
+        """Analyze image content and extract information."""
+        return extraction.analyze_image(image, page_num)
+
+    def extract_text_from_image_page(self, page):
+        """Extract text from a PDF page containing images."""
+        return extraction.extract_text_from_image_page(page, self.ocr_dpi, self.ocr_grayscale)
+
+    def extract_pdf_pages(self, file_path, workers=None, known=None):
+        """Extract the text of every page, falling back to OCR for scanned pages.
+
+        Text-layer pages are read inline; pages that need OCR are spread over a
+        process pool of `workers` processes (default: self.extract_workers).
+        `known` maps page numbers to text that is already available; those
+        pages are not extracted again.
+        """
+        workers = self.extract_workers if workers is None else workers
+        known = known or {}
+        try:
+            with fitz.open(file_path) as doc, metrics.span("extract.pdf", pages=len(doc)):
+                total_pages = len(doc)
+                logging.info(f"Processing {total_pages - len(known)} of {total_pages} pages...")
+                with metrics.span("extract.text", pages=total_pages - len(known)):
+                    pages = [known[i] if i in known else page.get_text().strip() for i, page in enumerate(doc)]
+                ocr_needed = [i for i, page_text in enumerate(pages) if not page_text and i not in known]
+                done = total_pages - len(ocr_needed)
+                self.report_progress(done, total_pages)
+
+                if workers > 1 and len(ocr_needed) > 1:
+                    try:
+                        for page_no, page_text in self.ocr_pages_parallel(file_path, ocr_needed, workers):
+                            self.check_cancelled()
+                            pages[page_no] = page_text
+                            done += 1
+                            self.report_progress(done, total_pages)
+                        return pages
+                    except (OSError, BrokenProcessPool) as e:
+                        logging.warning(f"Parallel OCR unavailable ({str(e)}), falling back to serial")
+                        ocr_needed = [i for i in ocr_needed if not pages[i]]
+
+                for i in ocr_needed:
+                    self.check_cancelled()
+                    with metrics.span("ocr.page", page=i + 1):
+                        pages[i] = self.extract_text_from_image_page(doc[i])
+                    done += 1
+                    self.report_progress(done, total_pages)
+                    
+                return pages
+        except Exception as e:
+            logging.error(f"Error processing PDF: {str(e)}")
+            raise
+
+    def iter_page_texts(self, file_path):
+        """Yield (page_no, text) from the text layer one page at a time, without OCR."""
+        with fitz.open(file_path) as doc:
+            for i, page in enumerate(doc):
+                self.check_cancelled()
+                yield i, page.get_text().strip()
+
+    def page_index(self, file_path):
+        """The PageIndex of file_path, built on first use and kept until the file changes."""
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        with self._page_index_lock:
+            index = self.page_indexes.get(key)
+            if index:
+                self.page_indexes.move_to_end(key)
+        metrics.count("cache.pages.hit" if index else "cache.pages.miss")
+        if index:
+            return index
+        # Built outside the lock; two threads missing on the same file at once both build it
+        with metrics.span("index.pages") as span_fields:
+            pages = []
+            retriever = BM25Index()
+            for _, page_text in self.iter_page_texts(file_path):
+                pages.append(page_text)
+                retriever.add(page_text)
+            span_fields["pages"] = len(pages)
+        index = PageIndex(pages, retriever)
+        with self._page_index_lock:
+            # An edited file gets a new key; drop the stale entry along with old ones
+            for old in [k for k in self.page_indexes if k[0] == key[0]]:
+                del self.page_indexes[old]
+            self.page_indexes[key] = index
+            while len(self.page_indexes) > self.max_page_indexes:
+                self.page_indexes.popitem(last=False)
+        return index
+
+    def ocr_pages_parallel(self, file_path, page_numbers, workers):
+        """Yield (page_no, text) as worker processes finish batches of pages."""
+        workers = min(workers, len(page_numbers))
+        # Several small batches per worker keep the pool balanced and progress smooth
+        batch_size = max(1, len(page_numbers) // (workers * 4))
+        batches = [page_numbers[i:i + batch_size] for i in range(0, len(page_numbers), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(extraction.ocr_pages, file_path, batch, self.ocr_dpi, self.ocr_grayscale)
+                for batch in batches
+            ]
+            try:
+                for future in as_completed(futures):
+                    for page_no, text, seconds in future.result():
+                        metrics.observe("ocr.page", seconds * 1000, kind="span", page=page_no + 1)
+                        yield page_no, text
+            finally:
+                # Don't make the pool finish queued batches nobody will read
+                for future in futures:
+                    future.cancel()
+
+    def report_progress(self, done, total, label="Processing page"):
+        if self.progress_callback and total:
+            self.progress_callback(done / total * 100)
+            self.update_status(f"{label} {done}/{total}")
+
+    def join_pages(self, pages):
+        return "".join(f"\n=== Page {i+1} ===\n{page_text}\n" for i, page_text in enumerate(pages))
+
+    def extract_full_pdf_content(self, file_path):
+        return self.join_pages(self.extract_pdf_pages(file_path))
+
+    def extractor_settings(self):
+        """Settings that change extracted text or chunks; part of the index cache key."""
+        return {"format": 4, "chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap,
+                "chunk_boundary": self.chunk_boundary, "ocr": "tesseract",
+                "ocr_dpi": self.ocr_dpi, "ocr_grayscale": self.ocr_grayscale}
+
+    def split_text_into_chunks(self, text, chunk_size=1000):
+        return [chunk.text for chunk in iter_chunks([text], chunk_size)]
+
+    def iter_chunks(self, pages):
+        """Stream chunks (with page/offset metadata) from an iterable of page texts."""
+        return iter_chunks(pages, self.chunk_size, self.chunk_overlap, self.chunk_boundary)
+
+    def load_index(self, file_path, cache_key=None):
+        """Return (cache key, StoredIndex) for a PDF, building or patching it if needed."""
+        settings = self.extractor_settings()
+        cache_key = cache_key or self.index_store.key_for(file_path, settings)
+
+        # Check the in-memory cache, then the on-disk index store
+        stored = self.pdf_cache.get(cache_key)
+        metrics.count("cache.pdf.hit" if stored else "cache.pdf.miss")
+        if not stored:
+            stored = self.index_store.load(cache_key)
+            metrics.count("cache.index_store.hit" if stored else "cache.index_store.miss")
+        if stored:
+            logging.info(f"Using cached index for {file_path}")
+        else:
+            logging.info(f"Processing PDF: {file_path}")
+            previous = self.index_store.previous_index(file_path, settings)
+            with metrics.span("index.build", incremental=previous is not None):
+                stored = self.build_index(file_path, cache_key, previous)
+        self.pdf_cache[cache_key] = stored
+        return cache_key, stored
+
+    def page_fingerprints(self, file_path):
+        with fitz.open(file_path) as doc:
+            return [extraction.page_fingerprint(doc, page) for page in doc]
+
+    def build_index(self, file_path, cache_key, previous=None):
+        """Extract, chunk and index a PDF, reusing unchanged pages from `previous`.
+
+        Pages are matched to the previous index of the same file by content
+        fingerprint, so only new or edited pages are extracted (and OCR'd);
+        their chunks are re-tokenized and patched into the BM25 postings.
+        """
+        fingerprints = self.page_fingerprints(file_path)
+        reused = {}  # new page number -> previous page number
+        if previous:
+            old_pages = {previous.page_fingerprint(i): i for i in range(previous.page_count)}
+            reused = {i: old_pages[fp] for i, fp in enumerate(fingerprints) if fp in old_pages}
+            logging.info(f"Re-indexing {len(fingerprints) - len(reused)} changed pages "
+                         f"of {len(fingerprints)}")
+        pages = self.extract_pdf_pages(
+            file_path, known={i: previous.page_text(j) for i, j in reused.items()}
+        )
+
+        if not reused:
+            with metrics.span("index.chunk") as fields:
+                chunks = list(self.iter_chunks(pages))
+                fields["chunks"] = len(chunks)
+            with metrics.span("index.bm25"):
+                retriever = BM25Index(chunk.text for chunk in chunks)
+        else:
+            # Chunks never span pages, so unchanged pages keep their chunks as-is
+            old_by_page = {}
+            for old_id in range(previous.chunk_count):
+                old_by_page.setdefault(previous.chunk_record(old_id).page, []).append(old_id)
+            chunks, id_map, added = [], {}, []
+            consumed = set()  # a duplicated page can only take over the old chunk ids once
+            for i, page_text in enumerate(pages):
+                if i in reused and reused[i] not in consumed:
+                    consumed.add(reused[i])
+                    for old_id in old_by_page.get(reused[i] + 1, []):
+                        record = previous.chunk_record(old_id)
+                        id_map[old_id] = len(chunks)
+                        chunks.append(record._replace(page=i + 1))
+                else:
+                    for chunk in self.iter_chunks([page_text]):
+                        added.append((len(chunks), chunk.text))
+                        chunks.append(chunk._replace(page=i + 1))
+            with metrics.span("index.bm25", added=len(added)):
+                retriever = BM25Index.patched(previous.retriever, id_map, added)
+        return self.index_store.save(cache_key, pages, chunks, retriever, fingerprints)
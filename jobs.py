@@ -0,0 +1,130 @@
+import queue
+import logging
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancel token has been set."""
+
+
+class CancelToken:
+    """Thread-safe cancellation flag shared between the UI and a running job."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled("Cancelled")
+
+
+class Job:
+    def __init__(self, fn, on_token=None, on_done=None, on_error=None):
+        self.fn = fn
+        self.on_token = on_token
+        self.on_done = on_done
+        self.on_error = on_error
+        self.token = CancelToken()
+
+
+class JobRunner:
+    """Runs StudyBot work on a background thread and hands results to the Tk loop.
+
+    Jobs run one at a time in submission order. A job's function returns either
+    a string or an iterable of tokens; each piece is delivered to `on_token`,
+    then `on_done()` or `on_error(exc)` is called. All callbacks run on the Tk
+    thread: the worker only puts events on a queue that `root.after` drains.
+    """
+
+    def __init__(self, root, poll_ms=30):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._current = None
+        self._thread = threading.Thread(target=self._run, name="studybot-worker", daemon=True)
+        self._thread.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, fn, on_token=None, on_done=None, on_error=None):
+        """Queue fn for the worker thread and return its CancelToken."""
+        job = Job(fn, on_token, on_done, on_error)
+        self._jobs.put(job)
+        return job.token
+
+    def cancel(self):
+        """Cancel the running job and drop any queued ones."""
+        try:
+            while True:
+                job = self._jobs.get_nowait()
+                if job is not None:
+                    job.token.cancel()
+                    self.post(job.on_error, JobCancelled("Cancelled"))
+        except queue.Empty:
+            pass
+        job = self._current
+        if job:
+            job.token.cancel()
+
+    def is_cancelled(self):
+        """True if the job currently running on the worker has been cancelled."""
+        job = self._current
+        return bool(job and job.token.cancelled)
+
+    @property
+    def busy(self):
+        return self._current is not None or not self._jobs.empty()
+
+    def post(self, callback, *args):
+        """Schedule callback(*args) on the Tk thread; safe to call from any thread."""
+        if callback:
+            self._events.put((callback, args))
+
+    def shutdown(self):
+        self.cancel()
+        self._jobs.put(None)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            self._current = job
+            try:
+                job.token.check()
+                result = job.fn()
+                if isinstance(result, str):
+                    self.post(job.on_token, result)
+                elif result is not None:
+                    try:
+                        for token in result:
+                            job.token.check()
+                            self.post(job.on_token, token)
+                    finally:
+                        close = getattr(result, "close", None)
+                        if close:
+                            close()
+                self.post(job.on_done)
+            except Exception as e:
+                self.post(job.on_error, e)
+            finally:
+                self._current = None
+
+    def _poll(self):
+        try:
+            while True:
+                callback, args = self._events.get_nowait()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    logging.error(f"UI callback failed: {str(e)}")
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_ms, self._poll)
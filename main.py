@@ -1,102 +1,29 @@
 import os
-import json
-import fitz  # PyMuPDF
-import pytesseract
-import cv2
-from PIL import Image
-from gpt4all import GPT4All
 import logging
-from functools import lru_cache
+import threading
 import numpy as np
 import time
+import hashlib
+from indexer import DocumentIndexer
+from corpus import CorpusIndex
+from embeddings import EMBED_MODEL_NAME, VectorIndex, embed_texts, fuse_scores, load_embedder, normalize_rows
+from formula_index import FormulaIndex
+from formula_store import FormulaStore
+from response_cache import ResponseCache
+from context import estimate_tokens, pack_context, split_into_groups
+from model_host import MODEL_NAME, MODEL_DIR, default_socket_path
+from metrics import metrics
+from scheduler import BATCH, DeadlineExceeded, Scheduler, SchedulerFull
+from backends import Backend, BackendError, GPT4AllBackend, default_backend_spec, make_backend
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-class StudyBot:
-    def __init__(self):
-        try:
-            model_path = os.path.join("models", "mistral-7b-instruct-v0.1.Q4_0.gguf")
-            if not os.path.exists(model_path):
-                logging.error(f"Model file not found at: {model_path}")
-                logging.error("Please download the model file and place it in the models folder")
-                exit(1)
-                
-            # Load GPT4All model in offline mode
-            self.model = GPT4All("mistral-7b-instruct-v0.1.Q4_0.gguf", 
-                                model_path="models/",
-                                allow_download=False)  # Prevent automatic downloads
-        except Exception as e:
-            logging.error(f"Failed to load GPT4All model: {str(e)}")
-            exit(1)
-
-        # Initialize formula storage (JSON file)
-        self.formulas_file = "formulas.json"
-        self.formulas_db = {}
-        self.init_formulas_db()
-        
-        # Add cache initialization
-        self.cache = {}
-        self.status_callback = None
-        self.progress_callback = None
-        self.pdf_cache = {}  # Add PDF content cache
-
-    # Add these new methods after __init__
-    def set_callbacks(self, status_cb=None, progress_cb=None):
-        """Set callback functions for status and progress updates."""
-        self.status_callback = status_cb
-        self.progress_callback = progress_cb
-
-    def update_status(self, message):
-        """Update status if callback is set."""
-        if self.status_callback:
-            self.status_callback(message)
-
-    def validate_and_fix_json(self):
-        try:
-            # Attempt to load the JSON file
-            with open(self.formulas_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Check if the "formulas" key exists and is a dictionary
-            if not isinstance(data.get("formulas", {}), dict):
-                raise ValueError("Invalid structure: 'formulas' key is not a dictionary.")
-            
-            logging.info("JSON file is valid.")
-            return data  # Return the valid data
-
-        except (json.JSONDecodeError, ValueError, UnicodeDecodeError) as e:
-            logging.error(f"Invalid JSON file: {str(e)}. Resetting to default.")
-            # Reset the JSON file to a valid default state
-            default_data = {"formulas": {}}
-            with open(self.formulas_file, 'w', encoding='utf-8') as f:
-                json.dump(default_data, f, ensure_ascii=False, indent=2)
-            return default_data  # Return the default data
+# Sampling settings for formula answers (safe_generate)
+SAFE_SAMPLING = {"temp": 0.7, "top_k": 40, "top_p": 0.4, "repeat_penalty": 1.18}
 
-    def init_formulas_db(self):
-        data = self.validate_and_fix_json()
-        self.formulas_db = data.get("formulas", {})
-
-    def normalize_query(self, query):
-        """Normalize the query to handle similar variations."""
-        filler_words = ['the', 'a', 'an', 'of', 'for', 'to', 'in', 'formula', 'equation']
-        words = query.lower().split()
-        normalized = ' '.join(word for word in words if word not in filler_words)
-        return normalized.strip()
-
-    @lru_cache(maxsize=100)
-    def get_formula(self, query):
-        """Get formula with caching."""
-        query_normalized = self.normalize_query(query)
-        
-        # Check if formula exists in memory
-        if query_normalized in self.formulas_db:
-            logging.info(f"Formula for '{query_normalized}' found in database.")
-            return f"📘 From Database:\n{self.formulas_db[query_normalized]}"
-        
-        logging.info(f"Formula for '{query_normalized}' not found. Generating...")
-        structured_prompt = f"""
-Provide a structured response for {query} using this exact format:
+FORMULA_INSTRUCTIONS = """
+Provide a structured response for the topic given at the end, using this exact format:
 
 ### Formula
 Plain text: [Write the formula using simple characters like ^, *, /, sqrt()]
@@ -118,135 +45,346 @@ Result: [final answer with unit]
 - [key point 1]
 - [key point 2]
 """
-        response = self.safe_generate(structured_prompt)
-        self.formulas_db[query_normalized] = response
+
+class StudyBot(DocumentIndexer):
+    def __init__(self, model_socket=None, backend=None):
+        super().__init__("cache")
+
+        # The model loads in the background (or lives in a model daemon), so
+        # commands that don't generate text are served immediately. `backend`
+        # (a backends.Backend or a make_backend spec such as "stub" or a
+        # llama.cpp server URL) replaces the local GPT4All model, as does
+        # $STUDYBOT_BACKEND.
+        self._backend = None
+        self._backend_error = None
+        self._backend_ready = threading.Event()
+        # Orders and limits concurrent generations (see scheduler.py)
+        self.scheduler = Scheduler()
+
+        backend = backend or default_backend_spec()
+        model_socket = model_socket or default_socket_path()
+        if isinstance(backend, Backend):
+            self.backend = backend
+        elif backend and backend != "gpt4all":
+            self.backend = make_backend(backend)
+        elif model_socket and self.attach_model_daemon(model_socket):
+            logging.info(f"Using model daemon at {model_socket}")
+        else:
+            model_path = os.path.join(MODEL_DIR, MODEL_NAME)
+            if not os.path.exists(model_path):
+                logging.error(f"Model file not found at: {model_path}")
+                logging.error("Please download the model file and place it in the models folder")
+                exit(1)
+            threading.Thread(target=self._load_backend, name="model-loader", daemon=True).start()
+
+        # Initialize formula storage (JSON snapshot + append-only log)
+        self.formulas_file = "formulas.json"
+        self.formula_store = FormulaStore(self.formulas_file)
+        self.formulas_db = {}
+        self.formula_match_threshold = 0.75
+        self._formula_lock = threading.Lock()  # the fuzzy index isn't safe to read while it grows
+        self.init_formulas_db()
+        
+        # Cache of finished generations, keyed on prompt + model + sampling params
+        self.cache = ResponseCache(max_entries=256, ttl=7 * 24 * 3600,
+                                   disk_dir=os.path.join("cache", "responses"))
+        self.indexed_db = {}
+        self.retriever = None
+        # Guards swapping the studied chapter; readers take a consistent snapshot and let go
+        self._chapter_lock = threading.Lock()
+        # "keyword" (BM25), "semantic" (embeddings) or "hybrid" (both, fused)
+        self.retrieval_mode = "keyword"
+        self.hybrid_weight = 0.5  # share of the vector score in hybrid mode
+        self.embed_batch_size = 64
+        self._embedder = None
+        self.vectors = None  # VectorIndex over the indexed chapter's chunks
+        # Prompt budget: context window minus room reserved for the answer
+        self.context_window = 2048
+        self.answer_tokens = 200
+        self.context_budget = None  # optional cap on packed context tokens
+        self.summary_mode = "mapreduce"  # or "single": one prompt over the leading chunks
+        self.summary_tokens = 256  # length of each partial summary
+        self.current_index_key = None
+        self.summary_cache = {}
+        self.corpus = None  # CorpusIndex over documents/, built by index_corpus
+
+    def _load_backend(self):
         try:
-            with open(self.formulas_file, 'w', encoding='utf-8') as f:
-                json.dump({"formulas": self.formulas_db}, f, indent=2)
-            logging.info(f"Formula for '{query_normalized}' saved to formulas.json.")
+            start = time.time()
+            self._backend = GPT4AllBackend.load()
+            logging.info(f"Model loaded in {time.time() - start:.1f}s")
         except Exception as e:
-            logging.error(f"Failed to save formula to file: {str(e)}")
-        
-        return f"🧮 **Formula Result:**\n{response}"
+            logging.error(f"Failed to load GPT4All model: {str(e)}")
+            self._backend_error = e
+        finally:
+            self._backend_ready.set()
 
-    def analyze_image(self, image, page_num):
-        """Analyze image content and extract information."""
+    def attach_model_daemon(self, socket_path):
+        """Use a model kept resident by model_host.py; False if it isn't answering."""
         try:
-            # Convert to grayscale for better processing
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Extract text using OCR
-            text = pytesseract.image_to_string(gray)
-            
-            # Detect image type (graph, diagram, picture)
-            edges = cv2.Canny(gray, 100, 200)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Basic image classification
-            if len(contours) > 20:
-                image_type = "Graph/Chart"
-            elif len(contours) > 5:
-                image_type = "Diagram"
-            else:
-                image_type = "Picture"
-                
-            return {
-                'type': image_type,
-                'text': text.strip(),
-                'page': page_num,
-                'complexity': len(contours)
-            }
-        except Exception as e:
-            logging.error(f"Image analysis failed: {str(e)}")
+            self.backend = GPT4AllBackend.connect(socket_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Model daemon at {socket_path} is not available: {str(e)}")
+            return False
+        return True
+
+    @property
+    def backend(self):
+        """The generation backend; blocks until the background load has finished."""
+        if not self._backend_ready.is_set():
+            self.update_status("Waiting for the model to load...")
+            self._backend_ready.wait()
+        if self._backend_error:
+            raise RuntimeError(f"Failed to load GPT4All model: {str(self._backend_error)}")
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+        self.scheduler.capacity = getattr(backend, "parallel", 1)
+        self._backend_error = None
+        self._backend_ready.set()
+
+    @property
+    def embedder(self):
+        """The sentence-embedding model, loaded on first use."""
+        if self._embedder is None:
+            self.update_status("Loading the embedding model...")
+            self._embedder = load_embedder()
+        return self._embedder
+
+    def init_formulas_db(self):
+        self.formulas_db = self.formula_store.load()
+        self.formula_index = FormulaIndex(self.formulas_db, self.formula_match_threshold)
+
+    def normalize_query(self, query):
+        """Normalize the query to handle similar variations."""
+        filler_words = ['the', 'a', 'an', 'of', 'for', 'to', 'in', 'formula', 'equation']
+        words = query.lower().split()
+        normalized = ' '.join(word for word in words if word not in filler_words)
+        return normalized.strip()
+
+    def get_formula(self, query):
+        """Get formula with caching."""
+        return "".join(self.get_formula_stream(query))
+
+    def get_formula_stream(self, query):
+        """Yield the formula answer piece by piece; generated text is saved when complete."""
+        stored = self.formula_from_database(query)
+        if stored is not None:
+            yield stored
+            return
+        yield from self.generate_formula_stream(query)
+
+    def formula_from_database(self, query):
+        """The stored answer for query (or a close variant of its name), or None. Never generates."""
+        query_normalized = self.normalize_query(query)
+        with self._formula_lock:
+            match = self.formula_index.lookup(query_normalized)
+        metrics.count("cache.formula.hit" if match else "cache.formula.miss")
+        if not match:
             return None
+        key, score = match
+        logging.info(f"Formula for '{query_normalized}' found in database as '{key}' (similarity {score:.2f}).")
+        return f"📘 From Database:\n{self.formulas_db[key]}"
 
-    def extract_text_from_image_page(self, page, save_path="images/page.png"):
-        """Extract text from a PDF page containing images."""
+    @metrics.timed("query.formula")
+    def generate_formula_stream(self, query):
+        """Generate a formula answer without looking in the database first, and save it."""
+        query_normalized = self.normalize_query(query)
+        logging.info(f"Formula for '{query_normalized}' not found. Generating...")
+        yield "🧮 **Formula Result:**\n"
+        tokens = []
+        for token in self.safe_generate_stream(self.formula_prompt(query), prefix=FORMULA_INSTRUCTIONS):
+            tokens.append(token)
+            yield token
+        self.save_formula(query_normalized, "".join(tokens))
+
+    def formula_prompt(self, query):
+        # The topic goes last so every formula prompt shares FORMULA_INSTRUCTIONS as a prefix
+        return f"{FORMULA_INSTRUCTIONS}\nTopic: {query}\n"
+
+    def save_formula(self, key, response):
+        # formulas_db is the store's dict; only the store writes it, under its lock
         try:
-            pix = page.get_pixmap()
-            pix.save(save_path)
-            img = cv2.imread(save_path)
-            
-            # Use the new analyze_image method
-            analysis = self.analyze_image(img, page.number + 1)
-            if analysis and analysis['text']:
-                return f"""
-Page {analysis['page']} Image Analysis:
-Type: {analysis['type']}
-Text Content: {analysis['text']}
-"""
-            return ""
-            
+            self.formula_store.put(key, response)
+            logging.info(f"Formula for '{key}' saved to the formula log.")
         except Exception as e:
-            logging.error(f"Error processing image page: {str(e)}")
-            return ""
-
-    def extract_full_pdf_content(self, file_path):
-        full_text = ""
+            logging.error(f"Failed to save formula to file: {str(e)}")
+        with self._formula_lock:
+            self.formula_index.add(key)
+
+    def prefill_formulas(self, topics, batch_size=16, max_length=2048):
+        """Generate and store formulas for every topic not in the database yet.
+
+        Topics are normalized and deduplicated against stored entries (and
+        each other) with the same fuzzy matching as get_formula, then sent to
+        the backend batch_size at a time. Each answer is appended to the
+        formula log as soon as it completes, so an interrupted run resumes
+        where it stopped; formulas.json is rewritten once, at the end.
+        Returns (generated, skipped, failed) counts.
+        """
+        planned = FormulaIndex(threshold=self.formula_match_threshold)
+        todo, skipped = [], 0
+        for topic in topics:
+            key = self.normalize_query(topic)
+            if not key or self.formula_index.lookup(key) or planned.lookup(key):
+                skipped += 1
+                continue
+            planned.add(key)
+            todo.append((topic, key))
+        logging.info(f"Prefilling {len(todo)} formulas ({skipped} already stored or duplicated)")
+
+        generated, failed = 0, 0
+        compact_every = self.formula_store.compact_every
+        self.formula_store.compact_every = float("inf")
         try:
-            with fitz.open(file_path) as doc:
-                total_pages = len(doc)
-                logging.info(f"Processing all {total_pages} pages...")
-                
-                for i, page in enumerate(doc):
-                    if self.progress_callback:
-                        progress = (i + 1) / total_pages * 100
-                        self.progress_callback(progress)
-                        self.status_callback(f"Processing page {i+1}/{total_pages}")
-                    
-                    page_text = page.get_text().strip()
-                    if not page_text:
-                        page_text = self.extract_text_from_image_page(page)
-                    full_text += f"\n=== Page {i+1} ===\n{page_text}\n"
-                    
-                return full_text
-        except Exception as e:
-            logging.error(f"Error processing PDF: {str(e)}")
-            raise
-
-    def split_text_into_chunks(self, text, chunk_size=1000):
-        chunks = []
-        while text:
-            chunk = text[:chunk_size]
-            cutoff = chunk.rfind("\n\n")
-            if cutoff == -1:
-                cutoff = len(chunk)
-            chunks.append(text[:cutoff].strip())
-            text = text[cutoff:].strip()
-        return chunks
+            for start in range(0, len(todo), batch_size):
+                self.check_cancelled()
+                wave = todo[start:start + batch_size]
+                done = set()
+
+                def on_complete(i, text):
+                    if not self.is_cancelled():  # a cancelled answer may be cut short
+                        self.save_formula(wave[i][1], text)
+                        done.add(i)
+
+                try:
+                    with self.scheduler.slot(BATCH) as ticket:
+                        self.backend.generate_batch([self.formula_prompt(topic) for topic, _ in wave],
+                                                    lambda: self.keep_generating() and ticket.should_continue(),
+                                                    on_complete, prefix=FORMULA_INSTRUCTIONS,
+                                                    max_tokens=max_length, **SAFE_SAMPLING)
+                except (BackendError, OSError) as e:
+                    # Finished entries are already saved; the rest are retried on the next run
+                    logging.error(f"Formula batch failed: {str(e)}")
+                generated += len(done)
+                failed += len(wave) - len(done)
+                self.report_progress(start + len(wave), len(todo), "Generating formula")
+        finally:
+            self.formula_store.compact_every = compact_every
+            if self.formula_store.pending:
+                self.formula_store.compact()
+        return generated, skipped, failed
 
     def index_chapter(self, file_path):
         try:
-            cache_key = os.path.basename(file_path)
-            
-            # Check cache first
-            if cache_key in self.pdf_cache:
-                logging.info("Using cached PDF content")
-                raw_text = self.pdf_cache[cache_key]
-            else:
-                logging.info(f"Processing PDF: {file_path}")
-                raw_text = self.extract_full_pdf_content(file_path)
-                self.pdf_cache[cache_key] = raw_text
-                
-            chunks = self.split_text_into_chunks(raw_text)
-            self.indexed_db = {f"chunk_{i}": chunk for i, chunk in enumerate(chunks)}
-            
+            cache_key, stored = self.load_index(file_path)
+            vectors = None
+            if self.retrieval_mode != "keyword":
+                previous = self.index_store.previous_index(file_path, self.extractor_settings())
+                vectors = self.index_vectors(stored, previous)
+            self.index_store.record_source(file_path, cache_key, self.extractor_settings())
+            summaries = self.index_store.load_summaries(cache_key)
+            chunks = stored.chunks()
+            indexed_db = {f"chunk_{i}": chunk for i, chunk in enumerate(chunks)}
+            with self._chapter_lock:
+                self.current_index_key = cache_key
+                self.summary_cache = summaries
+                self.indexed_db = indexed_db
+                self.retriever = stored.retriever
+                self.vectors = vectors
+
             return f"""✅ In-depth Study completed:
 - Full PDF processed successfully
 - Created {len(chunks)} content chunks
 - Ready for detailed queries"""
-            
+
         except Exception as e:
             logging.error(f"Failed to index chapter: {str(e)}")
             raise
 
+    def index_vectors(self, stored, previous=None):
+        """Embed a stored index's chunks, reusing rows from `previous` where possible.
+
+        previous is the last index of the same PDF; its chunks with unchanged
+        text keep their embeddings, so a re-index only embeds new chunks.
+        """
+        matrix = self.index_store.load_vectors(stored.key, EMBED_MODEL_NAME)
+        if matrix is not None:
+            return VectorIndex(matrix)
+        texts = stored.chunks()
+        old, known = None, {}
+        if previous is not None and previous.key != stored.key:
+            old = self.index_store.load_vectors(previous.key, EMBED_MODEL_NAME)
+            if old is not None:
+                known = {text: i for i, text in enumerate(previous.chunks())}
+        missing = [i for i, text in enumerate(texts) if text not in known]
+        logging.info(f"Embedding {len(missing)} of {len(texts)} chunks")
+
+        def on_batch(done):
+            self.check_cancelled()
+            self.report_progress(done, len(missing), "Embedding chunk")
+
+        new = embed_texts(self.embedder, [texts[i] for i in missing], self.embed_batch_size, on_batch)
+        dims = new.shape[1] if len(new) else (old.shape[1] if old is not None else 0)
+        matrix = np.zeros((len(texts), dims), dtype=np.float32)
+        if missing:
+            matrix[missing] = new
+        reused = [i for i, text in enumerate(texts) if text in known]
+        if reused:
+            matrix[reused] = old[[known[texts[i]] for i in reused]]
+        return VectorIndex(self.index_store.save_vectors(stored.key, EMBED_MODEL_NAME, matrix))
+
+    def retrieve_chunks(self, question, k=5):
+        """Return the k chunks most relevant to the question, best first.
+
+        retrieval_mode picks BM25 keyword matching, embedding similarity
+        ("semantic"), or both with their scores fused ("hybrid").
+        """
+        with self._chapter_lock:
+            key, indexed_db, retriever, vectors = self.current_index_key, self.indexed_db, self.retriever, self.vectors
+        if not retriever:
+            return []
+        if self.retrieval_mode != "keyword" and vectors is None:
+            vectors = self.index_vectors(self.pdf_cache[key])
+            with self._chapter_lock:
+                if self.current_index_key == key:
+                    self.vectors = vectors
+        with metrics.span("retrieve", mode=self.retrieval_mode, k=k):
+            if self.retrieval_mode == "keyword":
+                ranked = retriever.search(question, k)
+            else:
+                query = normalize_rows(self.embedder.embed([question]))
+                if self.retrieval_mode == "semantic":
+                    ranked = vectors.search(query, k)
+                else:
+                    keyword = dict(retriever.search(question, 4 * k))
+                    vector = dict(vectors.search(query, 4 * k))
+                    ranked = fuse_scores(keyword, vector, self.hybrid_weight)[:k]
+        return [indexed_db[f"chunk_{doc_id}"] for doc_id, _ in ranked]
+
+    def count_tokens(self, text):
+        """Token count from the model's tokenizer when it has one, else an estimate."""
+        counter = getattr(self._backend, "count_tokens", None)  # don't wait for a loading model
+        return counter(text) if counter else estimate_tokens(text)
+
+    def build_prompt(self, template, chunks, **fields):
+        """Fill the template's {context} with as many chunks as fit the token budget.
+
+        Chunks are taken in the order given (best first) and deduplicated;
+        answer_tokens are reserved for the model's reply. Returns (prompt,
+        prefix): prefix holds the text before {context} and the text before
+        the first other field, the parts a backend can reuse across calls.
+        """
+        with metrics.span("prompt.build") as span_fields:
+            overhead = self.count_tokens(template.format(context="", **fields))
+            budget = self.context_window - self.answer_tokens - overhead
+            if self.context_budget:
+                budget = min(budget, self.context_budget)
+            context, used = pack_context(chunks, max(budget, 0), self.count_tokens)
+            span_fields["context_tokens"] = used
+        logging.info(f"Packed {used} context tokens (budget {budget})")
+        cut = min((template.index(f"{{{name}}}") for name in fields), default=len(template))
+        prefix = (template[:template.index("{context}")], template[:cut].format(context=context))
+        return template.format(context=context, **fields), prefix
+
     def answer_from_chapter(self, question):
-        matches = []
-        for chunk in self.indexed_db.values():
-            if any(word in chunk.lower() for word in question.lower().split()):
-                matches.append(chunk)
-        context = "\n\n".join(matches[:3])
-        prompt = f"""
+        return "".join(self.answer_from_chapter_stream(question))
+
+    @metrics.timed("query.answer")
+    def answer_from_chapter_stream(self, question):
+        template = """
 Answer the question using the following textbook content:
 
 {context}
@@ -254,49 +392,126 @@ Answer the question using the following textbook content:
 Question: {question}
 Answer:
 """
-        return self.model.generate(prompt)
+        prompt, prefix = self.build_prompt(template, self.retrieve_chunks(question, k=10), question=question)
+        yield from self.generate_stream(prompt, prefix=prefix, max_tokens=self.answer_tokens)
 
     def summarize_chapter(self):
-        all_text = "\n\n".join(self.indexed_db.values())
-        prompt = f"""
+        return "".join(self.summarize_chapter_stream())
+
+    @metrics.timed("query.summary")
+    def summarize_chapter_stream(self):
+        template = """
 Summarize this chapter in bullet points. Include:
 - Key laws and concepts
 - Important formulas (in simple plain text)
 - Key figures or diagrams if mentioned
 - Applications or implications if explained
 
-{all_text[:8000]}
+{context}
+"""
+        with self._chapter_lock:
+            texts = list(self.indexed_db.values())
+        if self.summary_mode == "mapreduce":
+            texts = self.reduce_summaries(texts, template)
+        prompt, prefix = self.build_prompt(template, texts)
+        yield from self.generate_stream(prompt, prefix=prefix, max_tokens=self.answer_tokens)
+
+    def reduce_summaries(self, texts, final_template):
+        """Map-reduce: summarize groups of texts until they fit the final prompt.
+
+        Chunk groups are summarized first, then the partial summaries are merged
+        level by level. Partial summaries are cached next to the chapter index,
+        so repeat summaries of the same PDF skip straight to the final pass.
+        """
+        map_template = """
+Summarize this part of a textbook chapter in concise bullet points. Keep key laws,
+concepts, formulas (in simple plain text), figures and applications.
+
+{context}
+"""
+        merge_template = """
+Combine these partial summaries of a textbook chapter into one concise list of
+bullet points, removing repetition:
+
+{context}
 """
-        return self.model.generate(prompt)
+        def budget_for(template, reserve):
+            return self.context_window - reserve - self.count_tokens(template.format(context=""))
+
+        template = map_template
+        level = 0
+        while sum(self.count_tokens(text) for text in texts) > budget_for(final_template, self.answer_tokens):
+            groups = split_into_groups(texts, budget_for(template, self.summary_tokens), self.count_tokens)
+            if len(groups) == len(texts) and level > 0:
+                break  # merging no longer shrinks anything; let the final prompt truncate
+            level += 1
+            self.update_status(f"Summarizing {len(groups)} sections (pass {level})...")
+            prompts = [template.format(context="\n\n".join(group)) for group in groups]
+            texts = self.cached_generate_batch(prompts, prefix=template[:template.index("{context}")],
+                                               max_tokens=self.summary_tokens)
+            template = merge_template
+        return texts
+
+    def cached_generate_batch(self, prompts, prefix=None, **kwargs):
+        """Generate completions for prompts, reusing cached partial summaries."""
+        keys = [hashlib.sha256(f"{self.backend.name}|{sorted(kwargs.items())}|{prompt}".encode("utf-8")).hexdigest()
+                for prompt in prompts]
+        with self._chapter_lock:
+            index_key, summaries = self.current_index_key, self.summary_cache
+        missing = [i for i, key in enumerate(keys) if key not in summaries]
+        metrics.count("cache.summary.hit", len(keys) - len(missing))
+        metrics.count("cache.summary.miss", len(missing))
+        if missing:
+            results = self.generate_batch([prompts[i] for i in missing], prefix=prefix, **kwargs)
+            for i, text in zip(missing, results):
+                summaries[keys[i]] = text.strip()
+            if index_key:
+                self.index_store.save_summaries(index_key, summaries)
+        return [summaries[key] for key in keys]
 
     def query_pdf(self, filename, question):
+        return "".join(self.query_pdf_stream(filename, question))
+
+    @metrics.timed("query.pdf")
+    def query_pdf_stream(self, filename, question):
         try:
             self.update_status(f"Processing PDF: {filename}")
-            text = ""
             filepath = os.path.join("documents", filename)
             if not os.path.exists(filepath):
                 logging.error(f"File '{filename}' not found.")
-                return f"❌ Error: File '{filename}' not found."
-            with fitz.open(filepath) as doc:
-                for i, page in enumerate(doc):
-                    if i >= 10:
-                        break
-                    text += page.get_text()
-
-            if not text.strip():
+                yield f"❌ Error: File '{filename}' not found."
+                return
+            index = self.page_index(filepath)
+
+            if not any(index.pages):
                 logging.warning("The document is empty or unreadable.")
-                return "❌ Error: The document is empty or unreadable."
+                yield "❌ Error: The document is empty or unreadable."
+                return
 
             self.update_status("Generating response...")
-            response = self.model.generate(
-                f"Answer based on this document:\n{text[:10000]}\n\nQuestion: {question}\nAnswer:"
+            yield "📄 PDF Answer:\n"
+            prompt, prefix = self.build_prompt(
+                "Answer based on this document:\n{context}\n\nQuestion: {question}\nAnswer:",
+                self.select_pages(index, question),
+                question=question,
             )
+            yield from self.generate_stream(prompt, prefix=prefix, max_tokens=self.answer_tokens)
             self.update_status("Done")
-            return f"📄 PDF Answer:\n{response}"
         except Exception as e:
             self.update_status(f"Error: {str(e)}")
             logging.error(f"Error processing PDF query: {str(e)}")
-            return f"❌ Error: {str(e)}"
+            yield f"❌ Error: {str(e)}"
+
+    def select_pages(self, index, question, k=10):
+        """Up to k pages most relevant to question, best first, labelled with their page number.
+
+        Falls back to the opening pages when no page shares a term with the question.
+        """
+        with metrics.span("retrieve", mode="pages", k=k):
+            ranked = [page_no for page_no, _ in index.retriever.search(question, k)]
+        if not ranked:
+            ranked = [i for i, page_text in enumerate(index.pages) if page_text][:k]
+        return [f"[Page {i + 1}]\n{index.pages[i]}" for i in ranked]
 
     def list_files(self):
         try:
@@ -306,40 +521,94 @@ Summarize this chapter in bullet points. Include:
             logging.error(f"Error listing files: {str(e)}")
             return []
 
+    def index_corpus(self, workers=None):
+        """Index every PDF in documents/ into one corpus for cross-document queries."""
+        paths = [os.path.join("documents", name) for name in self.list_files()]
+        corpus = CorpusIndex(self.index_store).build(self, paths, workers)
+        self.corpus = corpus
+        message = f"""✅ Library indexed:
+- {len(corpus.files)} PDFs, {len(corpus)} content chunks
+- Ready for library queries"""
+        for name, error in corpus.failed:
+            message += f"\n❌ Skipped {name}: {error}"
+        return message
+
+    def corpus_query(self, question, files=None):
+        return "".join(self.corpus_query_stream(question, files))
+
+    @metrics.timed("query.library")
+    def corpus_query_stream(self, question, files=None):
+        """Answer from the best chunks across the whole library (or just `files`)."""
+        if not self.corpus:
+            raise ValueError("Please index the library first")
+        hits = self.corpus.search(question, k=10, files=files)
+        if not hits:
+            yield "❌ No matching content found in the library."
+            return
+        template = """
+Answer using these excerpts from several textbooks. Each excerpt starts with its source.
+
+{context}
+
+Question: {question}
+Answer (mention the sources you used):
+"""
+        chunks = [f"[{hit.file}, page {hit.page}]\n{hit.text}" for hit in hits]
+        prompt, prefix = self.build_prompt(template, chunks, question=question)
+        yield "📚 Library Answer:\n"
+        yield from self.generate_stream(prompt, prefix=prefix, max_tokens=self.answer_tokens)
+        sources = dict.fromkeys(f"{hit.file} (page {hit.page})" for hit in hits)
+        yield "\n\nSources:\n" + "\n".join(f"- {source}" for source in sources)
+
     def indepth_query(self, question):
         """Get detailed answers after in-depth study"""
+        return "".join(self.indepth_query_stream(question))
+
+    @metrics.timed("query.indepth")
+    def indepth_query_stream(self, question):
+        """Streaming variant of indepth_query."""
         if not self.indexed_db:
             raise ValueError("Please complete In-depth Study first")
         
-        # Use more context chunks for detailed answers
-        matches = []
-        for chunk in self.indexed_db.values():
-            if any(word in chunk.lower() for word in question.lower().split()):
-                matches.append(chunk)
-        
-        context = "\n\n".join(matches[:5])  # Use more context chunks
-        prompt = f"""
-Provide a detailed answer using this textbook content:
-
-{context}
-
-Question: {question}
+        template = """
+Provide a detailed answer to the question at the end, using this textbook content.
 Please structure your answer with:
 - Main explanation
 - Key concepts involved
 - Examples if applicable
 - Related topics or connections
 
+{context}
+
+Question: {question}
 Answer:
 """
-        return "📚 Detailed Answer:\n" + self.model.generate(prompt)
+        # Use more context chunks for detailed answers
+        prompt, prefix = self.build_prompt(template, self.retrieve_chunks(question, k=15), question=question)
+        yield "📚 Detailed Answer:\n"
+        yield from self.generate_stream(prompt, prefix=prefix, max_tokens=self.answer_tokens)
 
     def search_query(self, question):
         """General search using GPT model"""
-        prompt = f"""
-Provide a detailed answer to this question:
-
-Question: {question}
+        return "".join(self.search_query_stream(question))
+
+    @metrics.timed("query.search")
+    def search_query_stream(self, question):
+        """Streaming variant of search_query."""
+        prompt, instructions = self.search_prompt(question)
+        yield "🔍 Search Result:\n"
+        yield from self.generate_stream(prompt, prefix=instructions)
+
+    def cached_search_answer(self, question):
+        """search_query's answer if the response cache has it, else None. Never waits for the model."""
+        prompt, _ = self.search_prompt(question)
+        answer = self.cached_response(prompt)
+        return None if answer is None else "🔍 Search Result:\n" + answer
+
+    def search_prompt(self, question):
+        """(prompt, instructions prefix) for a general search question."""
+        instructions = """
+Provide a detailed answer to the question below.
 
 Please structure your response with:
 - Main explanation
@@ -347,33 +616,160 @@ Please structure your response with:
 - Examples or applications
 - Related topics
 - Additional resources (if relevant)
-
-Answer:
 """
-        return "🔍 Search Result:\n" + self.model.generate(prompt)
+        return f"{instructions}\nQuestion: {question}\n\nAnswer:\n", instructions
 
     def clear_cache(self):
-        """Clear the formula cache."""
-        self.get_formula.cache_clear()
+        """Clear the response cache."""
         self.cache.clear()
         logging.info("Cache cleared")
         if self.status_callback:
             self.status_callback("Cache cleared")
 
     def safe_generate(self, prompt, retries=3, max_length=2048):
-        """Optimized model generation with length limit."""
-        try:
-            return self.model.generate(
-                prompt,
-                max_tokens=max_length,
-                temp=0.7,
-                top_k=40,
-                top_p=0.4,
-                repeat_penalty=1.18
-            )
-        except Exception as e:
-            logging.error(f"Generation failed: {str(e)}")
-            raise
+        """Generate with fixed sampling settings, retrying transient backend failures."""
+        return "".join(self.safe_generate_stream(prompt, retries=retries, max_length=max_length))
+
+    def safe_generate_stream(self, prompt, retries=3, max_length=2048, prefix=None):
+        """Like safe_generate, but yields tokens as the model produces them.
+
+        A failed attempt is only retried if it had not produced any tokens
+        yet, so the caller never sees a partial answer repeated.
+        """
+        for attempt in range(1, retries + 1):
+            started = False
+            try:
+                for token in self.generate_stream(prompt, prefix=prefix, max_tokens=max_length, **SAFE_SAMPLING):
+                    started = True
+                    yield token
+                return
+            except (BackendError, OSError) as e:
+                if started or attempt == retries:
+                    raise
+                logging.warning(f"Generation attempt {attempt} failed ({str(e)}), retrying")
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+    def generate_batch(self, prompts, prefix=None, **kwargs):
+        """Generate several independent completions with one backend call.
+
+        Backends that can serve several prompts at once (e.g. a llama.cpp
+        server with multiple slots) run them concurrently. Prompts already in
+        the response cache are not sent again. prefix, if given, is shared by
+        all the prompts (see generate_stream). Batches wait for the model in
+        the scheduler's batch class.
+        """
+        kwargs = self.scheduler.cap(kwargs)
+        keys = [self.cache.make_key(prompt, self.backend.name, kwargs) for prompt in prompts]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, text in enumerate(results) if text is None]
+        finished = []
+
+        def on_complete(j, text):
+            results[missing[j]] = text
+            finished.append(j)
+            self.report_progress(len(prompts) - len(missing) + len(finished), len(prompts), "Generating part")
+
+        metrics.count("cache.response.hit", len(prompts) - len(missing))
+        metrics.count("cache.response.miss", len(missing))
+        if missing:
+            self.report_progress(len(prompts) - len(missing), len(prompts), "Generating part")
+            try:
+                with self.scheduler.slot(BATCH) as ticket, metrics.span("generate.batch", prompts=len(missing)):
+                    self.backend.generate_batch([prompts[i] for i in missing],
+                                                lambda: self.keep_generating() and ticket.should_continue(),
+                                                on_complete, **self.with_prefix(kwargs, prefix))
+            except Exception as e:
+                logging.error(f"Batch generation failed: {str(e)}")
+                raise
+            self.check_cancelled()
+            ticket.check()
+            for i in missing:
+                self.cache.put(keys[i], results[i])
+        return results
+
+    def generate_stream(self, prompt, prefix=None, **kwargs):
+        """Yield tokens from the backend as they are generated.
+
+        Repeated requests are answered from the response cache. Generation stops
+        early if the cancel callback fires; JobCancelled is then raised so a
+        truncated answer is never cached or mistaken for a complete one.
+        prefix marks the leading part of the prompt (instructions, packed
+        context) that later prompts are likely to repeat; backends that keep
+        evaluated prompt state skip re-evaluating it. It doesn't change the answer.
+        Cache misses wait for a scheduler slot first, which may raise
+        SchedulerFull or DeadlineExceeded.
+        """
+        kwargs = self.scheduler.cap(kwargs)
+        key = self.cache.make_key(prompt, self.backend.name, kwargs)
+        cached = self.cache.get(key)
+        metrics.count("cache.response.hit" if cached is not None else "cache.response.miss")
+        if cached is not None:
+            logging.info("Response served from cache")
+            yield cached
+            return
+        tokens = []
+        with self.scheduler.slot() as ticket:
+            start = time.perf_counter()
+            first = None
+            try:
+                for token in self.backend.stream(prompt, lambda: self.keep_generating() and ticket.should_continue(),
+                                                 **self.with_prefix(kwargs, prefix)):
+                    if first is None:
+                        # Time to first token is dominated by prompt evaluation
+                        first = time.perf_counter()
+                        metrics.observe("generate.first_token", (first - start) * 1000, kind="span")
+                    tokens.append(token)
+                    yield token
+            except Exception as e:
+                logging.error(f"Generation failed: {str(e)}")
+                raise
+            end = time.perf_counter()
+            metrics.observe("generate.total", (end - start) * 1000, kind="span", tokens=len(tokens))
+            if len(tokens) > 1 and end > first:
+                metrics.observe("generate.tokens_per_s", (len(tokens) - 1) / (end - first))
+            self.check_cancelled()
+            ticket.check()  # stopped at the deadline: don't cache a cut-off answer
+        self.cache.put(key, "".join(tokens))
+
+    def cached_response(self, prompt, **kwargs):
+        """What generate_stream(prompt, **kwargs) would serve from the response cache, or None.
+
+        Returns None while the model is still loading instead of waiting for it.
+        """
+        backend = self._backend
+        if backend is None:
+            return None
+        kwargs = self.scheduler.cap(kwargs)
+        cached = self.cache.get(self.cache.make_key(prompt, backend.name, kwargs))
+        if cached is not None:
+            # Misses are counted by the generate_stream call that follows
+            metrics.count("cache.response.hit")
+            logging.info("Response served from cache")
+        return cached
+
+    @staticmethod
+    def with_prefix(params, prefix):
+        # Kept out of the cache keys: the prefix only affects how fast the prompt is evaluated
+        return dict(params, prefix=prefix) if prefix else params
+
+    def stats_report(self):
+        """Stage timings, cache hit rates and response cache counters as text."""
+        cache = self.cache.stats()
+        queue = self.scheduler.stats()
+        return (metrics.format() + f"\nresponse cache: {cache['entries']} entries, "
+                f"{cache['disk_hits']} disk hits, {cache['evictions']} evictions"
+                f"\nscheduler: {queue['running']}/{queue['capacity']} running, waiting "
+                + ", ".join(f"{count} {priority}" for priority, count in queue['waiting'].items()))
+
+    def keep_generating(self):
+        """Polled by the backend between tokens; returning False stops generation."""
+        return not self.is_cancelled()
+
+def print_stream(tokens):
+    """Print tokens as they arrive instead of waiting for the full answer."""
+    for token in tokens:
+        print(token, end="", flush=True)
+    print()
 
 def main():
     bot = StudyBot()
@@ -385,50 +781,79 @@ def main():
             print("❌ Please enter a command. Type 'help' for available commands.")
             continue
 
-        if user_input.lower() in ['exit', 'quit']:
-            break
-        elif user_input.lower() == 'help':
-            print("\nCommands:")
-            print("ask <question> - Get a formula")
-            print("search <question> - General knowledge search")  # Add this
-            print("pdf <filename> <question> - Query a PDF")
-            print("list - Show available PDFs")
-            print("index <filename> - Study PDF in-depth")
-            print("query <question> - Ask detailed question after indexing")
-            print("summary - Summarize the chapter")
-            print("exit - Quit")
-        elif user_input.lower() == 'list':
-            files = bot.list_files()
-            print("\nAvailable PDFs:" if files else "\nNo PDFs found")
-            for f in files:
-                print(f"- {f}")
-        elif user_input.lower().startswith('pdf '):
-            parts = user_input.split(maxsplit=2)
-            if len(parts) < 3:
-                print("Usage: pdf filename.pdf 'your question'")
-            else:
-                print(bot.query_pdf(parts[1], parts[2]))
-        elif user_input.lower().startswith('index '):
-            parts = user_input.split(maxsplit=1)
-            if len(parts) < 2:
-                print("Usage: index filename.pdf")
-            else:
-                print(bot.index_chapter(parts[1]))
-        elif user_input.lower() == 'summary':
-            print(bot.summarize_chapter())
-        elif user_input.lower().startswith('ask '):
-            print(bot.get_formula(user_input[4:]))
-        elif user_input.lower().startswith('query '):
-            if not bot.indexed_db:
-                print("❌ Please index a PDF chapter first using 'index filename.pdf'")
+        try:
+            if user_input.lower() in ['exit', 'quit']:
+                break
+            elif user_input.lower() == 'help':
+                print("\nCommands:")
+                print("ask <question> - Get a formula")
+                print("search <question> - General knowledge search")  # Add this
+                print("pdf <filename> <question> - Query a PDF")
+                print("list - Show available PDFs")
+                print("index <filename> - Study PDF in-depth")
+                print("query <question> - Ask detailed question after indexing")
+                print("summary - Summarize the chapter")
+                print("mode keyword|semantic|hybrid - Choose how chapter chunks are retrieved")
+                print("library - Index every PDF in documents/")
+                print("stats - Show stage timings and cache hit rates")
+                print("lquery [@file.pdf ...] <question> - Ask across all indexed PDFs")
+                print("exit - Quit")
+            elif user_input.lower() == 'list':
+                files = bot.list_files()
+                print("\nAvailable PDFs:" if files else "\nNo PDFs found")
+                for f in files:
+                    print(f"- {f}")
+            elif user_input.lower().startswith('pdf '):
+                parts = user_input.split(maxsplit=2)
+                if len(parts) < 3:
+                    print("Usage: pdf filename.pdf 'your question'")
+                else:
+                    print_stream(bot.query_pdf_stream(parts[1], parts[2]))
+            elif user_input.lower().startswith('index '):
+                parts = user_input.split(maxsplit=1)
+                if len(parts) < 2:
+                    print("Usage: index filename.pdf")
+                else:
+                    print(bot.index_chapter(parts[1]))
+            elif user_input.lower().startswith('mode '):
+                mode = user_input[5:].strip().lower()
+                if mode not in ("keyword", "semantic", "hybrid"):
+                    print("Usage: mode keyword|semantic|hybrid")
+                else:
+                    bot.retrieval_mode = mode
+                    bot.vectors = None
+                    print(f"Retrieval mode: {mode}")
+            elif user_input.lower() == 'stats':
+                print(bot.stats_report())
+            elif user_input.lower() == 'library':
+                print(bot.index_corpus())
+            elif user_input.lower().startswith('lquery '):
+                words = user_input[7:].split()
+                files = [word[1:] for word in words if word.startswith('@')]
+                question = " ".join(word for word in words if not word.startswith('@'))
+                if not bot.corpus:
+                    print("❌ Please index the library first using 'library'")
+                elif not question:
+                    print("Usage: lquery [@file.pdf ...] 'your question'")
+                else:
+                    print_stream(bot.corpus_query_stream(question, files or None))
+            elif user_input.lower() == 'summary':
+                print_stream(bot.summarize_chapter_stream())
+            elif user_input.lower().startswith('ask '):
+                print_stream(bot.get_formula_stream(user_input[4:]))
+            elif user_input.lower().startswith('query '):
+                if not bot.indexed_db:
+                    print("❌ Please index a PDF chapter first using 'index filename.pdf'")
+                else:
+                    question = user_input[6:].strip()
+                    print_stream(bot.indepth_query_stream(question))
+            elif user_input.lower().startswith('search '):
+                question = user_input[7:].strip()
+                print_stream(bot.search_query_stream(question))
             else:
-                question = user_input[6:].strip()
-                print(bot.indepth_query(question))
-        elif user_input.lower().startswith('search '):
-            question = user_input[7:].strip()
-            print(bot.search_query(question))
-        else:
-            print("❌ Invalid command. Type 'help' for available commands.")
+                print("❌ Invalid command. Type 'help' for available commands.")
+        except (SchedulerFull, DeadlineExceeded, BackendError) as e:
+            print(f"\n❌ {str(e)}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+"""Timing spans, counters and histograms for the StudyBot pipeline.
+
+Stages record into the shared `metrics` registry:
+
+    with metrics.span("retrieve", mode="keyword"):
+        ...
+    metrics.observe("generate.tokens_per_s", rate)
+    metrics.count("cache.pdf.hit")
+
+or, for a whole method (generators are timed until exhausted),
+@metrics.timed("query.indepth").
+
+Histograms use fixed log-spaced buckets, so memory stays constant however
+long the bot runs. Set $STUDYBOT_TRACE to a file path (or call
+enable_trace) to also append every span as one JSON line.
+"""
+import os
+import json
+import math
+import time
+import inspect
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+# Bucket i holds values up to BASE ** i: about 19% resolution from 0.001 upwards
+BASE = 2 ** 0.25
+MIN_BUCKET = -40
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = {}  # bucket index -> count
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        index = MIN_BUCKET if value <= 0 else max(MIN_BUCKET, math.ceil(math.log(value, BASE)))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, p):
+        """Approximate value below which p percent of samples fall."""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(BASE ** index, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """Thread-safe registry of histograms (spans in ms, other observations) and counters."""
+
+    def __init__(self, trace_path=None):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self._trace = None
+        if trace_path:
+            self.enable_trace(trace_path)
+
+    def enable_trace(self, path):
+        """Append one JSON line per span and observation to path; None turns tracing off."""
+        with self._lock:
+            if self._trace:
+                self._trace.close()
+                self._trace = None
+            if path:
+                self._trace = open(path, "a", encoding="utf-8", buffering=1)
+                logging.info(f"Writing metrics trace to {path}")
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Time the enclosed block into the `name` histogram, in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield fields  # the block may add fields, e.g. counts only known at the end
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, kind="span", **fields)
+
+    def timed(self, name):
+        """Decorator form of span; for generator functions it times the whole stream."""
+        def decorate(fn):
+            if inspect.isgeneratorfunction(fn):
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        yield from fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def observe(self, name, value, kind="value", **fields):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).add(value)
+            if self._trace:
+                record = {"ts": time.time(), "kind": kind, "name": name, "value": round(value, 3)}
+                record.update(fields)
+                self._trace.write(json.dumps(record, default=str) + "\n")
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "histograms": {name: h.summary() for name, h in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def format(self):
+        """The snapshot as a plain-text table."""
+        snapshot = self.snapshot()
+        lines = [f"{'stage (ms, or /s)':<28}{'count':>7}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"]
+        for name, s in snapshot["histograms"].items():
+            if s["count"]:
+                lines.append(f"{name:<28}{s['count']:>7}" + "".join(
+                    f"{s[key]:>10.1f}" for key in ("mean", "p50", "p90", "p99", "max")))
+        hits = {}
+        for name, value in snapshot["counters"].items():
+            prefix, _, outcome = name.rpartition(".")
+            if outcome in ("hit", "miss"):
+                hits.setdefault(prefix, {"hit": 0, "miss": 0})[outcome] = value
+            else:
+                lines.append(f"{name:<28}{value:>7}")
+        for prefix, counts in sorted(hits.items()):
+            lookups = counts["hit"] + counts["miss"]
+            lines.append(f"{prefix:<28}{lookups:>7} lookups, {counts['hit'] / lookups:.0%} hits")
+        return "\n".join(lines)
+
+
+metrics = Metrics(os.environ.get("STUDYBOT_TRACE"))
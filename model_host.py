@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+
+MODEL_NAME = "mistral-7b-instruct-v0.1.Q4_0.gguf"
+MODEL_DIR = "models"
+DEFAULT_SOCKET = os.path.join("cache", "studybot-model.sock")
+
+
+def load_local_model():
+    """Load the GPT4All model from models/ in offline mode, with prompt prefix caching."""
+    from gpt4all import GPT4All
+    from prefix_cache import PrefixCachedModel
+    return PrefixCachedModel(GPT4All(MODEL_NAME,
+                                     model_path=MODEL_DIR + "/",
+                                     allow_download=False))  # Prevent automatic downloads
+
+
+def default_socket_path():
+    """Socket of a running model daemon, if one is configured or listening."""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = os.environ.get("STUDYBOT_MODEL_SOCKET", DEFAULT_SOCKET)
+    return path if os.path.exists(path) else None
+
+
+class RemoteModel:
+    """GPT4All-compatible client for a model kept resident by `python model_host.py`.
+
+    Each generate() call opens a connection, sends one JSON request line and
+    reads back JSON lines: {"token": ...} repeated, then {"done": true} or
+    {"error": ...}. Closing the connection stops generation on the server.
+    The daemon keeps the prompt prefix cache, so `prefix` is passed through.
+    """
+
+    accepts_prefix = True
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def ping(self):
+        with self._connect() as conn:
+            conn.sendall(b'{"ping": true}\n')
+            return json.loads(conn.makefile("rb").readline()).get("ok", False)
+
+    def generate(self, prompt, streaming=False, callback=None, **kwargs):
+        tokens = self._stream(prompt, callback, kwargs)
+        return tokens if streaming else "".join(tokens)
+
+    def _connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.socket_path)
+        return conn
+
+    def _stream(self, prompt, callback, kwargs):
+        with self._connect() as conn:
+            request = {"prompt": prompt, "kwargs": kwargs}
+            conn.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            for line in conn.makefile("rb"):
+                message = json.loads(line)
+                if "error" in message:
+                    raise RuntimeError(f"Model daemon error: {message['error']}")
+                if message.get("done"):
+                    return
+                token = message["token"]
+                if callback and not callback(-1, token):
+                    return  # dropping the connection stops the daemon's generation
+                yield token
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        if request.get("ping"):
+            self._send({"ok": True})
+            return
+        client_gone = threading.Event()
+
+        def keep_going(token_id, response):
+            return not client_gone.is_set()
+
+        # One model, one generation at a time
+        with self.server.model_lock:
+            try:
+                tokens = self.server.model.generate(request["prompt"], streaming=True,
+                                                    callback=keep_going, **request.get("kwargs", {}))
+                for token in tokens:
+                    if not client_gone.is_set():
+                        try:
+                            self._send({"token": token})
+                        except OSError:
+                            client_gone.set()  # drain so the model thread can finish
+                if not client_gone.is_set():
+                    self._send({"done": True})
+            except OSError:
+                pass
+            except Exception as e:
+                logging.error(f"Generation failed: {str(e)}")
+                self._send({"error": str(e)})
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, model):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # stale socket from a previous run
+        super().__init__(socket_path, _RequestHandler)
+        self.model = model
+        self.model_lock = threading.Lock()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the StudyBot model loaded for the CLI and GUI.")
+    parser.add_argument("--socket", default=os.environ.get("STUDYBOT_MODEL_SOCKET", DEFAULT_SOCKET))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not hasattr(socket, "AF_UNIX"):
+        logging.error("Unix sockets are not available on this platform")
+        return 1
+    logging.info(f"Loading {MODEL_NAME}...")
+    server = ModelServer(args.socket, load_local_model())
+    logging.info(f"Model daemon listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Fill the formula database ahead of time, e.g. overnight.
+
+    python prefill.py topics.txt
+    python prefill.py - < topics.txt
+    python prefill.py topics.txt --backend http://127.0.0.1:8080 --concurrency 4
+
+Topics are one per line; blank lines and lines starting with # are ignored.
+Entries that are already stored are skipped, so rerunning after an
+interruption picks up where the last run stopped.
+"""
+import sys
+import logging
+import argparse
+
+from main import StudyBot
+
+
+def read_topics(stream):
+    topics = []
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            topics.append(line)
+    return topics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate formula entries for a list of topics.")
+    parser.add_argument("topics", help="file with one topic per line, or - for stdin")
+    parser.add_argument("--backend", help='backend spec: "gpt4all", "stub" or a llama.cpp server URL')
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="prompts in flight at once, for backends that run several")
+    args = parser.parse_args(argv)
+
+    if args.topics == "-":
+        topics = read_topics(sys.stdin)
+    else:
+        with open(args.topics, "r", encoding="utf-8") as f:
+            topics = read_topics(f)
+
+    bot = StudyBot(backend=args.backend)
+    if hasattr(bot.backend, "parallel"):
+        bot.backend.parallel = args.concurrency
+    bot.set_callbacks(status_cb=logging.info, progress_cb=lambda percent: None)
+    try:
+        generated, skipped, failed = bot.prefill_formulas(topics, batch_size=4 * args.concurrency)
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; finished formulas are saved, rerun to continue")
+        return 130
+    print(f"Generated {generated}, skipped {skipped}, failed {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Reuse of evaluated prompt prefixes for a local GPT4All model.
+
+StudyBot's prompts start with a fixed instruction template and, for
+follow-up questions, often the same packed context. Evaluating those tokens
+is most of the latency on CPU. PrefixCachedModel snapshots the model state
+(the KV cache) right after a prefix is evaluated and keeps the most recently
+used snapshots; a later prompt that starts with a cached prefix restores the
+snapshot and only evaluates the rest.
+
+Callers mark reusable prefixes with generate(..., prefix=...), either one
+string or a tuple of nested strings (e.g. the instructions, then the
+instructions plus context) so a shorter snapshot still helps when a longer
+one misses.
+"""
+import ctypes
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+# GPT4All.generate's defaults, needed because suffixes go through prompt_model directly
+GENERATE_DEFAULTS = {"temp": 0.7, "top_k": 40, "top_p": 0.4, "min_p": 0.0,
+                     "repeat_penalty": 1.18, "repeat_last_n": 64, "n_batch": 8}
+
+
+def _state_api():
+    """The llmodel state functions, or None if this GPT4All build lacks them."""
+    try:
+        from gpt4all._pyllmodel import llmodel
+        llmodel.llmodel_get_state_size.argtypes = [ctypes.c_void_p]
+        llmodel.llmodel_get_state_size.restype = ctypes.c_uint64
+        llmodel.llmodel_save_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+        llmodel.llmodel_save_state_data.restype = ctypes.c_uint64
+        llmodel.llmodel_restore_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+        llmodel.llmodel_restore_state_data.restype = ctypes.c_uint64
+        return llmodel
+    except (ImportError, AttributeError) as e:
+        logging.warning(f"Prompt prefix caching unavailable: {str(e)}")
+        return None
+
+
+class PrefixCachedModel:
+    """GPT4All-compatible wrapper that keeps an LRU of model states for prompt prefixes.
+
+    Not thread-safe: like the model itself, one generation at a time (the
+    backend and the model daemon both serialize calls).
+    """
+
+    accepts_prefix = True
+
+    def __init__(self, model, max_states=8, max_bytes=1 << 30):
+        self.model = model
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        # prefix digest -> (state bytes, n_past, token history bytes), least recently used first
+        self.states = OrderedDict()
+        self.bytes = 0
+        self._api = _state_api()
+        self._scratch = None
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate(self, prompt, streaming=False, callback=None, prefix=None, **kwargs):
+        boundaries = self._boundaries(prompt, prefix)
+        if not boundaries or self._api is None:
+            return self.model.generate(prompt, streaming=streaming, callback=callback, **kwargs)
+        tokens = self._generate(prompt, boundaries, callback, kwargs)
+        return tokens if streaming else "".join(tokens)
+
+    def _boundaries(self, prompt, prefix):
+        """Prefixes of prompt to snapshot, shortest first; the prompt itself is excluded."""
+        if not prefix:
+            return []
+        candidates = [prefix] if isinstance(prefix, str) else prefix
+        return sorted({p for p in candidates if p and len(p) < len(prompt) and prompt.startswith(p)}, key=len)
+
+    def _generate(self, prompt, boundaries, callback, kwargs):
+        params = dict(GENERATE_DEFAULTS)
+        params.update(kwargs)
+        params["n_predict"] = params.pop("max_tokens", 200)
+        llm = self.model.model  # the low-level LLModel
+
+        start = time.perf_counter()
+        offset = 0
+        for i in reversed(range(len(boundaries))):
+            if self._restore(llm, boundaries[i]):
+                offset = len(boundaries[i])
+                boundaries = boundaries[i + 1:]
+                break
+        metrics.count("cache.prefix.hit" if offset else "cache.prefix.miss")
+        reused = offset
+        for boundary in boundaries:
+            # As GPT4All does for system prompts: n_predict=0 evaluates without sampling,
+            # and "%1%2" keeps llmodel from appending a blank line after the text
+            llm.prompt_model(prompt[offset:len(boundary)], "%1%2", lambda token_id, response: True,
+                             n_predict=0, n_batch=params["n_batch"], reset_context=offset == 0)
+            self._save(llm, boundary)
+            offset = len(boundary)
+        metrics.observe("generate.prefix", (time.perf_counter() - start) * 1000, kind="span",
+                        reused_chars=reused, evaluated_chars=offset - reused)
+
+        def keep_going(token_id, response):
+            return callback(token_id, response) if callback else True
+
+        yield from llm.prompt_model_streaming(prompt[offset:], "%1", keep_going,
+                                              reset_context=False, **params)
+
+    @staticmethod
+    def _key(prefix):
+        return hashlib.sha256(prefix.encode("utf-8")).digest()
+
+    def _restore(self, llm, prefix):
+        entry = self.states.get(self._key(prefix))
+        if entry is None or llm.context is None:
+            return False
+        data, n_past, history = entry
+        # llmodel refuses an n_past beyond the tokens it last kept; re-evaluate in that case
+        if llm.context.tokens_size < n_past:
+            return False
+        buffer = ctypes.cast(ctypes.c_char_p(data), ctypes.POINTER(ctypes.c_uint8))
+        self._api.llmodel_restore_state_data(llm.model, buffer)
+        # The state data holds the KV cache but not llmodel's token history, which
+        # repeat_penalty reads; the first n_past entries may be another prompt's
+        ctypes.memmove(llm.context.tokens, history, len(history))
+        llm.context.n_past = n_past
+        self.states.move_to_end(self._key(prefix))
+        return True
+
+    def _save(self, llm, prefix):
+        size = self._api.llmodel_get_state_size(llm.model)
+        if self._scratch is None or len(self._scratch) < size:
+            self._scratch = (ctypes.c_uint8 * size)()
+        written = self._api.llmodel_save_state_data(llm.model, self._scratch)
+        if not written or written > self.max_bytes:
+            return
+        key = self._key(prefix)
+        if key in self.states:
+            self.bytes -= self._size(self.states.pop(key))
+        data = ctypes.string_at(self._scratch, written)
+        n_past = llm.context.n_past
+        history = ctypes.string_at(llm.context.tokens, n_past * ctypes.sizeof(ctypes.c_int32))
+        self.states[key] = (data, n_past, history)
+        self.bytes += len(data) + len(history)
+        while len(self.states) > self.max_states or self.bytes > self.max_bytes:
+            self.bytes -= self._size(self.states.popitem(last=False)[1])
+        logging.info(f"Cached prompt prefix state ({llm.context.n_past} tokens, {written / 2**20:.1f} MB)")
+
+    @staticmethod
+    def _size(entry):
+        return len(entry[0]) + len(entry[2])
+
+    def clear(self):
+        self.states.clear()
+        self.bytes = 0
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Bounded LRU cache of model completions with TTL and an optional disk tier.
+
+    Keys hash the final prompt, the model and the sampling parameters, so a
+    hit is only returned for an identical generation request.
+    """
+
+    def __init__(self, max_entries=256, ttl=None, disk_dir=None, max_disk_entries=5000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl  # seconds; None keeps entries until evicted
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()  # key -> (created, text)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk_writes = 0
+
+    @staticmethod
+    def make_key(prompt, model, params):
+        blob = json.dumps([prompt, model, sorted(params.items())], ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        """Return the cached text for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry:
+                self.hits += 1
+                self.disk_hits += 1
+                self._store(key, entry)
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        entry = (time.time(), text)
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(data["created"]):
+            os.remove(path)
+            return None
+        return data["created"], data["text"]
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created": entry[0], "text": entry[1]}, f)
+            os.replace(tmp_path, self._disk_path(key))
+            self._disk_writes += 1
+            if self._disk_writes % 64 == 0:
+                self._prune_disk()
+        except OSError as e:
+            logging.warning(f"Could not write response cache entry: {str(e)}")
+
+    def _prune_disk(self):
+        """Drop the least recently written disk entries beyond max_disk_entries."""
+        paths = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir)
+                 if name.endswith(".json")]
+        if len(paths) <= self.max_disk_entries:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            os.remove(path)
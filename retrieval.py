@@ -0,0 +1,170 @@
+import math
+import re
+import heapq
+from collections import Counter
+
+# Words that carry no retrieval signal and would otherwise match every chunk
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before
+being below between both but by can could did do does doing down during each few for
+from further had has have having he her here hers herself him himself his how i if in
+into is it its itself just me more most my myself no nor not now of off on once only or
+other our ours ourselves out over own same she should so some such than that the their
+theirs them themselves then there these they this those through to too under until up
+very was we were what when where which while who whom why will with would you your
+yours yourself yourselves explain describe tell give please
+""".split())
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def tokenize(text):
+    """Lowercase text and split it into index terms, dropping stopwords."""
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token.endswith("'s"):
+            token = token[:-2]
+        if token and token not in STOPWORDS:
+            terms.append(token)
+    return terms
+
+
+class BM25Index:
+    """Inverted index over text chunks with Okapi BM25 ranking."""
+
+    def __init__(self, chunks=(), k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> list of (chunk_id, term_frequency)
+        self.doc_lens = []
+        self.total_len = 0
+        for chunk in chunks:
+            self.add(chunk)
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    @classmethod
+    def from_packed(cls, vocab, pairs, doc_lens, total_len, k1=1.5, b=0.75):
+        """Wrap stored arrays (e.g. memory-mapped) as a read-only index."""
+        index = cls(k1=k1, b=b)
+        index.postings = PackedPostings(vocab, pairs)
+        index.doc_lens = doc_lens
+        index.total_len = total_len
+        return index
+
+    @classmethod
+    def patched(cls, old, id_map, added):
+        """Build a new index from `old` without re-tokenizing the chunks it keeps.
+
+        id_map maps old chunk ids that survive to their new ids; `added` is a
+        list of (new_id, text) for new or changed chunks.
+        """
+        index = cls(k1=old.k1, b=old.b)
+        index.doc_lens = [0] * (len(id_map) + len(added))
+        for old_id, new_id in id_map.items():
+            index.doc_lens[new_id] = old.doc_lens[old_id]
+        for term, entries in old.postings.items():
+            kept = [(id_map[doc_id], tf) for doc_id, tf in entries if doc_id in id_map]
+            if kept:
+                index.postings[term] = kept
+        for new_id, text in added:
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                index.postings.setdefault(term, []).append((new_id, tf))
+            index.doc_lens[new_id] = sum(counts.values())
+        index.total_len = sum(index.doc_lens)
+        return index
+
+    def add(self, text):
+        """Index a chunk and return its id."""
+        doc_id = len(self.doc_lens)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, []).append((doc_id, tf))
+        length = sum(counts.values())
+        self.doc_lens.append(length)
+        self.total_len += length
+        return doc_id
+
+    def idf(self, df, n=None):
+        n = len(self.doc_lens) if n is None else n
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def doc_freq(self, term):
+        """Number of chunks containing term."""
+        if isinstance(self.postings, PackedPostings):
+            return self.postings.count(term)
+        return len(self.postings.get(term, ()))
+
+    def search(self, query, k=5):
+        """Return up to k (chunk_id, score) pairs, best match first."""
+        if not self.doc_lens:
+            return []
+        avgdl = self.total_len / len(self.doc_lens) or 1.0
+        weights = {}
+        for term in set(tokenize(query)):
+            df = self.doc_freq(term)
+            if df:
+                weights[term] = self.idf(df)
+        scores = self.score(weights, avgdl)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def score(self, weights, avgdl, accept=None):
+        """BM25 scores {chunk_id: score} for terms weighted by their idf.
+
+        Callers that search several indexes as one (see corpus.py) pass
+        collection-wide idf weights and avgdl so scores are comparable.
+        accept(chunk_id) may exclude chunks.
+        """
+        k1, b = self.k1, self.b
+        scores = {}
+        for term, idf in weights.items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            for doc_id, tf in postings:
+                if accept and not accept(doc_id):
+                    continue
+                norm = k1 * (1 - b + b * self.doc_lens[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+
+class PackedPostings:
+    """Read-only postings view over a flat uint32 array of (chunk_id, tf) pairs."""
+
+    def __init__(self, vocab, pairs):
+        self.vocab = vocab  # term -> (start, count) into pairs
+        self.pairs = pairs
+
+    def __contains__(self, term):
+        return term in self.vocab
+
+    def count(self, term):
+        entry = self.vocab.get(term)
+        return entry[1] if entry else 0
+
+    def get(self, term, default=None):
+        entry = self.vocab.get(term)
+        if entry is None:
+            return default
+        start, count = entry
+        flat = self.pairs[2 * start:2 * (start + count)]
+        return list(zip(flat[0::2], flat[1::2]))
+
+    def items(self):
+        for term in self.vocab:
+            yield term, self.get(term)
+
+
+def pack_postings(postings):
+    """Flatten a postings dict into (vocab, flat pair list) for storage."""
+    vocab = {}
+    flat = []
+    for term, entries in postings.items():
+        vocab[term] = (len(flat) // 2, len(entries))
+        for doc_id, tf in entries:
+            flat.append(doc_id)
+            flat.append(tf)
+    return vocab, flat
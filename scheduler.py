@@ -0,0 +1,158 @@
+"""Admission control and ordering for generation requests.
+
+One CPU-bound model serves one generation at a time (a llama.cpp server a
+few), so every call that reaches the backend first takes a slot here:
+
+    with bot.scheduler.slot(BATCH) as ticket:
+        backend.generate_batch(prompts, ticket.should_continue, ...)
+
+Waiting requests are served interactive first, then batch, in arrival order
+within a class; a batch request that has waited longer than `batch_aging`
+seconds is served as if it were interactive, so it can't starve. Each class
+has a queue-depth limit; further requests are rejected at once with
+SchedulerFull. Responses served from a cache never take a slot.
+
+Deadlines and max_tokens caps are off unless a caller sets them. Callers
+such as server.py set the class, timeout, cap and cancellation check for
+everything a thread does with `scheduler.context(...)`; a request still
+queued or generating at its deadline fails with DeadlineExceeded.
+"""
+import time
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+
+from jobs import JobCancelled
+from metrics import metrics
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class SchedulerFull(RuntimeError):
+    """Too many requests are already waiting in this priority class."""
+
+
+class DeadlineExceeded(RuntimeError):
+    """A request did not finish before its deadline."""
+
+
+class Ticket:
+    def __init__(self, priority, deadline, is_cancelled, seq):
+        self.priority = priority
+        self.deadline = deadline  # time.monotonic() value, or None
+        self.is_cancelled = is_cancelled
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.started = None
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def should_continue(self):
+        """For backends' should_continue: False once cancelled or past the deadline."""
+        return not self.expired() and not (self.is_cancelled and self.is_cancelled())
+
+    def check(self):
+        if self.is_cancelled and self.is_cancelled():
+            raise JobCancelled("Cancelled")
+        if self.expired():
+            raise DeadlineExceeded(f"{self.priority.capitalize()} request timed out")
+
+
+class Scheduler:
+    def __init__(self, capacity=1, max_queued=None, batch_aging=60):
+        self.capacity = capacity  # generations allowed to run at once
+        self.max_queued = max_queued or {INTERACTIVE: 32, BATCH: 256}
+        self.batch_aging = batch_aging
+        self.running = 0
+        self._waiting = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._local = threading.local()
+
+    @contextmanager
+    def context(self, priority=INTERACTIVE, timeout=None, is_cancelled=None, max_tokens=None):
+        """Defaults for the slots this thread takes inside the block.
+
+        timeout (seconds) bounds the whole block, queueing included;
+        max_tokens caps each generation; is_cancelled() lets a request whose
+        caller has gone away leave the queue or stop generating.
+        """
+        previous = getattr(self._local, "context", None)
+        deadline = time.monotonic() + timeout if timeout else None
+        self._local.context = (priority, deadline, is_cancelled, max_tokens)
+        try:
+            yield
+        finally:
+            self._local.context = previous
+
+    def _context(self):
+        """(priority, deadline, is_cancelled, max_tokens) set by context(), or the defaults."""
+        return getattr(self._local, "context", None) or (INTERACTIVE, None, None, None)
+
+    def cap(self, params):
+        """params with max_tokens limited to the context's cap (before cache keys are made)."""
+        limit = self._context()[3]
+        if limit and params.get("max_tokens", 0) > limit:
+            return dict(params, max_tokens=limit)
+        return params
+
+    @contextmanager
+    def slot(self, priority=None, is_cancelled=None):
+        """Wait for a turn to generate and hold it for the duration of the block."""
+        context_priority, deadline, context_cancelled, _ = self._context()
+        priority = priority or context_priority
+        ticket = Ticket(priority, deadline, is_cancelled or context_cancelled, next(self._seq))
+        self._enqueue(ticket)
+        try:
+            self._wait(ticket)
+            yield ticket
+        finally:
+            with self._cond:
+                if ticket.started is None:
+                    self._waiting.remove(ticket)
+                else:
+                    self.running -= 1
+                self._cond.notify_all()
+
+    def _enqueue(self, ticket):
+        with self._cond:
+            queued = sum(1 for t in self._waiting if t.priority == ticket.priority)
+            if queued >= self.max_queued.get(ticket.priority, float("inf")):
+                metrics.count(f"scheduler.rejected.{ticket.priority}")
+                raise SchedulerFull(f"Too many {ticket.priority} requests waiting ({queued}), try again later")
+            self._waiting.append(ticket)
+
+    def _rank(self, ticket, now):
+        aged = ticket.priority != INTERACTIVE and now - ticket.enqueued > self.batch_aging
+        return (0 if ticket.priority == INTERACTIVE or aged else 1, ticket.seq)
+
+    def _wait(self, ticket):
+        with self._cond:
+            while True:
+                try:
+                    ticket.check()
+                except DeadlineExceeded:
+                    metrics.count(f"scheduler.expired.{ticket.priority}")
+                    raise
+                if self.running < self.capacity:
+                    now = time.monotonic()
+                    if min(self._waiting, key=lambda t: self._rank(t, now)) is ticket:
+                        break
+                # Wake up now and then to notice cancellation and deadlines
+                self._cond.wait(0.1)
+            self._waiting.remove(ticket)
+            self.running += 1
+            ticket.started = time.monotonic()
+        waited = (ticket.started - ticket.enqueued) * 1000
+        metrics.observe(f"scheduler.wait.{ticket.priority}", waited, kind="span")
+        if waited > 1000:
+            logging.info(f"{ticket.priority.capitalize()} request waited {waited / 1000:.1f}s for the model")
+
+    def stats(self):
+        with self._cond:
+            waiting = {priority: sum(1 for t in self._waiting if t.priority == priority) for priority in PRIORITIES}
+            return {"running": self.running, "capacity": self.capacity, "waiting": waiting}
@@ -0,0 +1,423 @@
+"""Serve one StudyBot to several frontends over local HTTP (TCP or a Unix socket).
+
+    python server.py                                  # http://127.0.0.1:8765
+    python server.py --socket cache/studybot-api.sock
+    python server.py --backend stub                   # no model file needed
+
+Endpoints take a JSON body (or query-string parameters) and stream the
+answer back as chunked text/plain:
+
+    POST /ask      {"question": ...}                 formula lookup or generation
+    POST /search   {"question": ...}                 general knowledge search
+    POST /pdf      {"file": ..., "question": ...}    question about a PDF in documents/
+    POST /index    {"file": ...}                     study a chapter in documents/ in depth
+    POST /query    {"question": ...}                 question about the studied chapter
+    POST /summary                                    summary of the studied chapter
+    GET  /stats, GET /health
+
+Interactive requests time out after INTERACTIVE_TIMEOUT seconds and are
+capped at INTERACTIVE_MAX_TOKENS, except /ask, whose answers are stored; any
+request may add "timeout" (seconds) to set its own deadline.
+
+    curl -N localhost:8765/ask -d '{"question": "ohm law"}'
+
+All clients share the bot, so the chapter studied through /index is the one
+/query and /summary use. Stored formulas and cached search answers are
+looked up on a small lookup pool and returned straight away. Every other
+request gets its own inference thread, and its generations queue in the
+bot's scheduler: summaries and indexing as batch work, everything else as
+interactive. The event loop only parses requests and writes tokens. A
+request beyond the scheduler's queue limit for its class is refused with
+503. A missed deadline fails the request with 504 if nothing was sent yet,
+otherwise as an error line ending the stream. Identical requests that
+arrive while one is in flight (ten students asking for the same formula)
+attach to it and receive the same tokens, so the model generates the answer
+once. "file" always names a PDF under documents/; anything resolving outside
+it is refused with 400. A request nobody is listening to any more is cancelled, whether it is
+still queued or already generating.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from jobs import CancelToken, JobCancelled
+from metrics import metrics
+from scheduler import BATCH, INTERACTIVE, DeadlineExceeded, SchedulerFull
+
+DEFAULT_PORT = 8765
+MAX_BODY = 1 << 20
+DOCUMENTS_DIR = "documents"
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+def _ask_key(bot, params):
+    return bot.normalize_query(params["question"])
+
+
+def document_name(name):
+    """name relative to documents/, or ValueError if it resolves outside it.
+
+    Clients choose the file, so absolute paths, ".." and symlinks must not
+    reach the rest of the disk.
+    """
+    root = os.path.realpath(DOCUMENTS_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"File must be inside {DOCUMENTS_DIR}/: {name}")
+    return os.path.relpath(path, root)
+
+
+def _chapter_key(bot, params):
+    # Answers depend on which chapter is studied, so only coalesce within one
+    return (bot.current_index_key, params.get("question", "").strip())
+
+
+# Limits for requests someone is waiting on; batch work has none
+INTERACTIVE_TIMEOUT = 300
+INTERACTIVE_MAX_TOKENS = 1024
+
+# Answers saved for later requests (formulas go into the formula database);
+# a capped one would be served cut short from then on, so these get no token cap
+UNCAPPED_ENDPOINTS = {"ask"}
+
+# Work that is slow and not waited on interactively; it yields the model to everything else
+BATCH_ENDPOINTS = {"index", "summary"}
+
+# required: fields that must be present; call: returns a string or token iterable;
+# key: coalescing key; lookup: returns a stored answer or None, without generating.
+# A "file" field has been through document_name, so it is relative to documents/.
+Endpoint = namedtuple("Endpoint", "required call key lookup")
+
+ENDPOINTS = {
+    "ask": Endpoint(("question",), lambda bot, p: bot.generate_formula_stream(p["question"]), _ask_key,
+                    lambda bot, p: bot.formula_from_database(p["question"])),
+    "search": Endpoint(("question",), lambda bot, p: bot.search_query_stream(p["question"]),
+                       lambda bot, p: p["question"].strip(),
+                       lambda bot, p: bot.cached_search_answer(p["question"])),
+    "pdf": Endpoint(("file", "question"), lambda bot, p: bot.query_pdf_stream(p["file"], p["question"]),
+                    lambda bot, p: (p["file"], p["question"].strip()), None),
+    "index": Endpoint(("file",), lambda bot, p: bot.index_chapter(os.path.join(DOCUMENTS_DIR, p["file"])),
+                      lambda bot, p: p["file"], None),
+    "query": Endpoint(("question",), lambda bot, p: bot.indepth_query_stream(p["question"]), _chapter_key, None),
+    "summary": Endpoint((), lambda bot, p: bot.summarize_chapter_stream(), _chapter_key, None),
+}
+
+
+class Flight:
+    """One generation in progress and the clients listening to it.
+
+    Events are ("token", text), ("done", None) or ("error", exception).
+    A client that joins late is first sent every token so far.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.token = CancelToken()
+        self.tokens = []
+        self.listeners = set()
+        self.finished = None  # the final event, once there is one
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        for text in self.tokens:
+            queue.put_nowait(("token", text))
+        if self.finished:
+            queue.put_nowait(self.finished)
+        self.listeners.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.listeners.discard(queue)
+        if not self.listeners and not self.finished:
+            logging.info(f"No clients left for {self.key}, cancelling")
+            self.token.cancel()
+
+    def publish(self, event):
+        if event[0] == "token":
+            self.tokens.append(event[1])
+        else:
+            self.finished = event
+        for queue in self.listeners:
+            queue.put_nowait(event)
+
+
+class StudyBotServer:
+    def __init__(self, bot):
+        self.bot = bot
+        # Stored answers are looked up here, so they never wait behind inference threads
+        self.lookups = ThreadPoolExecutor(max_workers=2, thread_name_prefix="studybot-lookup")
+        self.flights = {}  # (endpoint, key) -> Flight
+        self.admitted = {INTERACTIVE: 0, BATCH: 0}  # flights with an inference thread, per class
+        self._local = threading.local()  # .flight: the Flight this inference thread works on
+        bot.set_callbacks(status_cb=logging.debug, progress_cb=lambda percent: None,
+                          cancel_cb=self._cancelled)
+
+    def _cancelled(self):
+        flight = getattr(self._local, "flight", None)
+        return bool(flight and flight.token.cancelled)
+
+    @staticmethod
+    def request_context(scheduler, endpoint, params, is_cancelled=None):
+        """The scheduler context (class, deadline, token cap) a request runs in."""
+        priority = BATCH if endpoint in BATCH_ENDPOINTS else INTERACTIVE
+        interactive = priority == INTERACTIVE
+        timeout = float(params["timeout"]) if params.get("timeout") else None
+        if timeout is None and interactive:
+            timeout = INTERACTIVE_TIMEOUT
+        capped = interactive and endpoint not in UNCAPPED_ENDPOINTS
+        return scheduler.context(priority, timeout, is_cancelled, INTERACTIVE_MAX_TOKENS if capped else None)
+
+    async def answer(self, reader, writer, endpoint, params):
+        """Reply with a stored answer if there is one, else stream a (possibly shared) flight."""
+        spec = ENDPOINTS[endpoint]
+        key = (endpoint, spec.key(self.bot, params))
+        flight = self.flights.get(key)
+        if spec.lookup and not (flight and not flight.token.cancelled):
+            stored = await asyncio.get_running_loop().run_in_executor(self.lookups, self.lookup, endpoint, params)
+            if stored is not None:
+                await self.respond(writer, 200, stored)
+                return
+        await self.stream(reader, writer, self.start(endpoint, key, params))
+
+    def lookup(self, endpoint, params):
+        # Same context as generation, so capped parameters give the same cache keys
+        with self.request_context(self.bot.scheduler, endpoint, params):
+            return ENDPOINTS[endpoint].lookup(self.bot, params)
+
+    def start(self, endpoint, key, params):
+        """The flight answering this request, joining an identical one if it is in flight.
+
+        A new flight gets its own inference thread, so the scheduler alone
+        orders the work; raises SchedulerFull once its class has as many
+        flights as the scheduler would hold.
+        """
+        flight = self.flights.get(key)
+        if flight and not flight.token.cancelled:
+            metrics.count("server.coalesced")
+            return flight
+        priority = BATCH if endpoint in BATCH_ENDPOINTS else INTERACTIVE
+        scheduler = self.bot.scheduler
+        if self.admitted[priority] >= scheduler.max_queued[priority] + scheduler.capacity:
+            metrics.count(f"scheduler.rejected.{priority}")
+            raise SchedulerFull(f"Too many {priority} requests in progress, try again later")
+        self.admitted[priority] += 1
+        flight = self.flights[key] = Flight(key)
+        loop = asyncio.get_running_loop()
+
+        def finish(event):
+            self.admitted[priority] -= 1
+            flight.publish(event)
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+        threading.Thread(target=self._run, args=(loop, flight, endpoint, params, finish),
+                         name=f"studybot-{endpoint}", daemon=True).start()
+        return flight
+
+    def _run(self, loop, flight, endpoint, params, finish):
+        """Inference thread: produce the flight's tokens and hand them to the event loop."""
+        self._local.flight = flight
+        result = None
+        try:
+            with self.request_context(self.bot.scheduler, endpoint, params, lambda: flight.token.cancelled):
+                flight.token.check()
+                result = ENDPOINTS[endpoint].call(self.bot, params)
+                for text in [result] if isinstance(result, str) else result:
+                    flight.token.check()
+                    loop.call_soon_threadsafe(flight.publish, ("token", text))
+            loop.call_soon_threadsafe(finish, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(finish, ("error", e))
+        finally:
+            close = getattr(result, "close", None)
+            if close:
+                close()
+            self._local.flight = None
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, params = await self.read_request(reader)
+            endpoint = path.strip("/")
+            if endpoint == "health":
+                # Don't touch bot.backend here: it blocks while the model is loading
+                backend = self.bot._backend
+                await self.respond(writer, 200, {"ok": True, "model_ready": self.bot._backend_ready.is_set(),
+                                                 "backend": backend.name if backend else None})
+            elif endpoint == "stats":
+                await self.respond(writer, 200, self.bot.stats_report())
+            elif endpoint not in ENDPOINTS:
+                await self.respond(writer, 404, {"error": f"Unknown endpoint: {path}"})
+            elif method not in ("GET", "POST"):
+                await self.respond(writer, 405, {"error": "Use GET or POST"})
+            else:
+                missing = [name for name in ENDPOINTS[endpoint].required if not str(params.get(name, "")).strip()]
+                if missing:
+                    await self.respond(writer, 400, {"error": f"Missing field(s): {', '.join(missing)}"})
+                else:
+                    if "file" in ENDPOINTS[endpoint].required:
+                        params["file"] = document_name(str(params["file"]))
+                    await self.answer(reader, writer, endpoint, params)
+        except SchedulerFull as e:
+            await self.respond(writer, 503, {"error": str(e)})
+        except ValueError as e:
+            await self.respond(writer, 413 if "too large" in str(e) else 400, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line")
+        method, target, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY:
+            raise ValueError("Request body too large")
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON body: {str(e)}")
+            if not isinstance(body, dict):
+                raise ValueError("The JSON body must be an object")
+            params.update(body)
+        return method.upper(), url.path, params
+
+    async def respond(self, writer, status, body):
+        if isinstance(body, str):
+            data, content_type = body.encode("utf-8"), "text/plain; charset=utf-8"
+        else:
+            data, content_type = json.dumps(body).encode("utf-8"), "application/json"
+        writer.write(self.status_line(status, content_type) + f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    @staticmethod
+    def status_line(status, content_type):
+        return (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                f"Connection: close\r\n").encode("latin-1")
+
+    async def stream(self, reader, writer, flight):
+        """Send the flight's tokens as HTTP chunks until it finishes or the client leaves.
+
+        A client that hangs up is noticed at once, even before the first token
+        (while the request is still queued for the model), and stops listening.
+        """
+        queue = flight.subscribe()
+        hangup = asyncio.ensure_future(self.client_closed(reader))
+
+        async def next_event():
+            event = asyncio.ensure_future(queue.get())
+            await asyncio.wait((event, hangup), return_when=asyncio.FIRST_COMPLETED)
+            if not event.done():
+                event.cancel()
+                raise ConnectionResetError("Client disconnected")
+            return event.result()
+
+        try:
+            kind, value = await next_event()
+            if kind == "error":
+                # Nothing was sent yet, so the failure can still be a proper status
+                await self.respond(writer, self.error_status(value), {"error": str(value)})
+                return
+            writer.write(self.status_line(200, "text/plain; charset=utf-8") + b"Transfer-Encoding: chunked\r\n\r\n")
+            while kind == "token":
+                data = value.encode("utf-8")
+                if data:
+                    writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                    await writer.drain()
+                kind, value = await next_event()
+            if kind == "error":
+                # Headers are gone; report in the body like the CLI does
+                data = f"\n❌ Error: {str(value)}".encode("utf-8")
+                writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            hangup.cancel()
+            flight.unsubscribe(queue)
+
+    @staticmethod
+    async def client_closed(reader):
+        """Return once the client closes the connection (requests are one per connection)."""
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def error_status(error):
+        if isinstance(error, SchedulerFull):
+            return 503
+        if isinstance(error, DeadlineExceeded):
+            return 504
+        if isinstance(error, JobCancelled):
+            return 409
+        if isinstance(error, (ValueError, FileNotFoundError)):
+            return 400
+        return 500
+
+    def close(self):
+        for flight in self.flights.values():
+            flight.token.cancel()
+        self.lookups.shutdown(wait=False)
+
+
+async def serve(bot, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, ready=None):
+    """Run the API until cancelled; ready(server) is called once it is listening."""
+    app = StudyBotServer(bot)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # stale socket from a previous run
+        server = await asyncio.start_unix_server(app.handle, path=socket_path)
+        logging.info(f"StudyBot API listening on {socket_path}")
+    else:
+        server = await asyncio.start_server(app.handle, host, port)
+        logging.info(f"StudyBot API listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+    if ready:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        app.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve StudyBot to several frontends.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--backend", help='backend spec: "gpt4all", "stub" or a llama.cpp server URL')
+    args = parser.parse_args(argv)
+
+    from main import StudyBot
+    bot = StudyBot(backend=args.backend)
+    try:
+        asyncio.run(serve(bot, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
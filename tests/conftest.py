@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, since StudyBot keeps documents/, cache/ and formulas.json relative to it."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "documents").mkdir()
+    return tmp_path
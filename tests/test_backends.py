@@ -0,0 +1,62 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backends import LlamaCppBackend, StubBackend
+from context import estimate_tokens
+
+
+class FakeLlamaServer(BaseHTTPRequestHandler):
+    """Answers /tokenize with one token per whitespace-separated word."""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeLlamaServer.requests.append((self.path, body))
+        if self.path != "/tokenize":
+            self.send_error(404)
+            return
+        data = json.dumps({"tokens": list(range(len(body["content"].split())))}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def llama_url():
+    FakeLlamaServer.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLlamaServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_llamacpp_counts_tokens_with_the_server_tokenizer(llama_url):
+    backend = LlamaCppBackend(llama_url)
+    assert backend.count_tokens("ohm's law relates voltage and current") == 6
+    assert backend.count_tokens("ohm's law relates voltage and current") == 6
+    assert len(FakeLlamaServer.requests) == 1  # the repeat came from memory
+    assert FakeLlamaServer.requests[0] == ("/tokenize", {"content": "ohm's law relates voltage and current"})
+
+
+def test_llamacpp_estimates_when_the_server_is_down():
+    backend = LlamaCppBackend("http://127.0.0.1:9", timeout=1)
+    text = "ohm's law relates voltage and current"
+    assert backend.count_tokens(text) == estimate_tokens(text)
+
+
+def test_stub_is_deterministic():
+    backend = StubBackend(answer_tokens=8)
+    assert backend.generate("prompt") == backend.generate("prompt")
+    assert backend.generate("prompt") != backend.generate("other prompt")
+    assert len(list(backend.stream("prompt", max_tokens=3))) == 3
+    assert backend.calls == 5
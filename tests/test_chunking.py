@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from chunking import iter_chunks
+
+
+def chapter(paragraphs=40, seed=1):
+    rng = random.Random(seed)
+    vocab = "ohm law voltage current resistance newton force mass acceleration energy power".split()
+    return "\n\n".join(
+        ". ".join(" ".join(rng.choice(vocab) for _ in range(rng.randint(5, 15))) for _ in range(rng.randint(2, 6)))
+        + "." for _ in range(paragraphs))
+
+
+def test_chunks_point_back_into_their_page():
+    pages = [chapter(seed=1), "", "  short page  ", chapter(seed=2)]
+    chunks = list(iter_chunks(pages, chunk_size=500))
+    assert {chunk.page for chunk in chunks} == {1, 3, 4}
+    for chunk in chunks:
+        assert 0 < len(chunk.text) <= 500
+        text = pages[chunk.page - 1]
+        assert text[chunk.offset:chunk.offset + len(chunk.text)] == chunk.text
+
+
+def test_chunks_end_at_paragraphs_when_possible():
+    text = chapter()
+    chunks = list(iter_chunks([text], chunk_size=1000))
+    for chunk in chunks[:-1]:
+        assert text[chunk.offset + len(chunk.text):].startswith("\n\n")
+
+
+def test_without_overlap_chunks_tile_the_page():
+    text = chapter()
+    chunks = list(iter_chunks([text], chunk_size=1000))
+    assert "\n\n".join(chunk.text for chunk in chunks) == text
+
+
+@pytest.mark.parametrize("overlap", [0, 100, 200, 400, 499])
+def test_overlap_keeps_chunk_count_bounded(overlap):
+    text = chapter(paragraphs=80)
+    chunks = list(iter_chunks([text], chunk_size=1000, overlap=overlap))
+    offsets = [chunk.offset for chunk in chunks]
+    # Every step advances by at least a quarter of the window
+    assert all(b - a >= 250 for a, b in zip(offsets, offsets[1:]))
+    assert len(chunks) <= len(text) // 250 + 1
+    for previous, chunk in zip(chunks, chunks[1:]):
+        shared = previous.offset + len(previous.text) - chunk.offset
+        assert shared <= overlap
+
+
+def test_overlap_of_half_the_window_is_rejected():
+    with pytest.raises(ValueError):
+        list(iter_chunks(["text"], chunk_size=1000, overlap=500))
+
+
+def test_unbroken_text_is_cut_at_chunk_size():
+    chunks = list(iter_chunks(["x" * 2500], chunk_size=1000, boundary="none"))
+    assert [(len(chunk.text), chunk.offset) for chunk in chunks] == [(1000, 0), (1000, 1000), (500, 2000)]
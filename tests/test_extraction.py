@@ -0,0 +1,51 @@
+import fitz
+import numpy as np
+import pytest
+
+import extraction
+from extraction import PSM_BLOCK, PSM_LINE, triage_page
+
+
+def render(draw, dpi):
+    doc = fitz.open()
+    page = doc.new_page()
+    draw(page)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return extraction.pixmap_to_array(pix).copy()
+
+
+@pytest.mark.parametrize("dpi", [72, 150, 300])
+@pytest.mark.parametrize("text", ["V = I R", "Newton's second law: the net force on a body equals its mass times its acceleration."])
+def test_one_line_page_is_text(text, dpi):
+    gray = render(lambda page: page.insert_text((72, 300), text, fontsize=12), dpi)
+    kind, regions = triage_page(gray)
+    assert kind == "text"
+    assert [psm for *_, psm in regions] == [PSM_LINE]
+    x, y, w, h, _ = regions[0]
+    assert y <= 300 * dpi / 72 <= y + h
+
+
+def test_paragraphs_in_reading_order():
+    def draw(page):
+        page.insert_textbox(fitz.Rect(72, 72, 540, 200), "First paragraph of the chapter. " * 12, fontsize=11)
+        page.insert_textbox(fitz.Rect(72, 400, 540, 520), "Second paragraph, further down. " * 12, fontsize=11)
+
+    kind, regions = triage_page(render(draw, 150))
+    assert kind == "text"
+    assert [psm for *_, psm in regions] == [PSM_BLOCK, PSM_BLOCK]
+    assert regions[0][1] < regions[1][1]
+
+
+def test_blank_pages():
+    assert triage_page(render(lambda page: None, 150)) == ("blank", [])
+    rng = np.random.default_rng(0)
+    speckled = np.full((1650, 1275), 250, dtype=np.uint8)
+    speckled[rng.integers(0, 1650, 40), rng.integers(0, 1275, 40)] = 0
+    assert triage_page(speckled) == ("blank", [])
+
+
+def test_photograph_has_no_text_regions():
+    rng = np.random.default_rng(0)
+    gray = np.full((1650, 1275), 255, dtype=np.uint8)
+    gray[200:1200, 150:1100] = rng.integers(70, 190, (1000, 950))
+    assert triage_page(gray) == ("picture", [])
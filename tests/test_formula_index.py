@@ -0,0 +1,33 @@
+from formula_index import FormulaIndex, canonical_tokens
+
+KEYS = ["ohm's law", "newton's second law", "kinetic energy", "gravitational potential energy"]
+
+
+def test_canonical_tokens_ignore_order_filler_and_plurals():
+    assert canonical_tokens("What is the formula for Ohm's law?") == canonical_tokens("law of ohm")
+    assert canonical_tokens("Newton's laws") == canonical_tokens("newton law")
+    assert canonical_tokens("stress") == frozenset(["stress"])
+
+
+def test_exact_token_match():
+    index = FormulaIndex(KEYS)
+    assert index.lookup("the law of Ohm") == ("ohm's law", 1.0)
+    assert index.lookup("Kinetic Energy formula") == ("kinetic energy", 1.0)
+
+
+def test_close_variant_matches():
+    key, score = FormulaIndex(KEYS).lookup("newtons second laws of motion")
+    assert key == "newton's second law"
+    assert 0.75 <= score < 1.0
+
+
+def test_unrelated_or_empty_queries_miss():
+    index = FormulaIndex(KEYS)
+    assert index.lookup("capacitor charge") is None
+    assert index.lookup("energy") is None  # shares a word, but too different from either energy key
+    assert index.lookup("the formula") is None
+
+
+def test_threshold_controls_fuzziness():
+    assert FormulaIndex(KEYS, threshold=0.4).lookup("potential energy")[0] == "gravitational potential energy"
+    assert FormulaIndex(KEYS, threshold=0.95).lookup("potential energy") is None
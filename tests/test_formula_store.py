@@ -0,0 +1,74 @@
+import json
+import threading
+
+from formula_store import FormulaStore
+
+
+def test_put_is_replayed_on_load(tmp_path):
+    store = FormulaStore(str(tmp_path / "formulas.json"))
+    store.load()
+    store.put("ohm law", "V = I R")
+    store.put("power", "P = V I")
+    assert not (tmp_path / "formulas.json").exists()  # only the log was written
+
+    reloaded = FormulaStore(str(tmp_path / "formulas.json"))
+    assert reloaded.load() == {"ohm law": "V = I R", "power": "P = V I"}
+    assert reloaded.pending == 2
+
+
+def test_log_replays_on_top_of_snapshot(tmp_path):
+    (tmp_path / "formulas.json").write_text(json.dumps({"formulas": {"ohm law": "old", "force": "F = m a"}}))
+    store = FormulaStore(str(tmp_path / "formulas.json"))
+    store.load()
+    store.put("ohm law", "V = I R")
+    assert FormulaStore(str(tmp_path / "formulas.json")).load() == {"ohm law": "V = I R", "force": "F = m a"}
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    store = FormulaStore(str(tmp_path / "formulas.json"))
+    store.load()
+    store.put("ohm law", "V = I R")
+    with open(store.log_path, "a", encoding="utf-8") as f:
+        f.write('{"key": "power", "val')  # a crash mid-append
+
+    reloaded = FormulaStore(str(tmp_path / "formulas.json"))
+    assert reloaded.load() == {"ohm law": "V = I R"}
+    with open(store.log_path, "rb") as f:
+        assert f.read().endswith(b"\n")
+    reloaded.put("power", "P = V I")
+    assert FormulaStore(str(tmp_path / "formulas.json")).load() == {"ohm law": "V = I R", "power": "P = V I"}
+
+
+def test_compaction_folds_log_into_snapshot(tmp_path):
+    store = FormulaStore(str(tmp_path / "formulas.json"), compact_every=3)
+    store.load()
+    for i in range(4):
+        store.put(f"formula {i}", str(i))
+    snapshot = json.loads((tmp_path / "formulas.json").read_text())["formulas"]
+    assert snapshot == {"formula 0": "0", "formula 1": "1", "formula 2": "2"}
+    assert store.pending == 1
+    assert len(open(store.log_path, encoding="utf-8").readlines()) == 1
+    assert FormulaStore(str(tmp_path / "formulas.json")).load() == {f"formula {i}": str(i) for i in range(4)}
+
+
+def test_corrupt_snapshot_is_moved_aside(tmp_path):
+    (tmp_path / "formulas.json").write_text("{not json")
+    store = FormulaStore(str(tmp_path / "formulas.json"))
+    assert store.load() == {}
+    assert list(tmp_path.glob("formulas.json.corrupt-*"))
+
+
+def test_concurrent_puts_survive_compaction(tmp_path):
+    store = FormulaStore(str(tmp_path / "formulas.json"), compact_every=5)
+    store.load()
+
+    def writer(n):
+        for i in range(25):
+            store.put(f"formula {n}.{i}", str(i))
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(FormulaStore(str(tmp_path / "formulas.json")).load()) == 100
@@ -0,0 +1,124 @@
+import pickle
+import shutil
+import threading
+
+import fitz
+import pytest
+
+import extraction
+from indexer import DocumentIndexer
+from retrieval import BM25Index
+
+
+def text_page_pdf(path, *texts):
+    doc = fitz.open()
+    for text in texts:
+        doc.new_page().insert_text((72, 72), text, fontsize=12)
+    doc.save(path)
+
+
+def form_xobject_pdf(path, text):
+    """A one-page PDF whose content stream only draws a Form XObject ("q /fzFrm0 Do Q")."""
+    src = fitz.open()
+    src.new_page().insert_text((72, 72), text, fontsize=14)
+    doc = fitz.open()
+    page = doc.new_page()
+    page.show_pdf_page(page.rect, src, 0)
+    doc.save(path)
+
+
+def load_page_texts(path, cache_dir):
+    indexer = DocumentIndexer(str(cache_dir))
+    indexer.extract_workers = 1
+    key, stored = indexer.load_index(str(path))
+    indexer.index_store.record_source(str(path), key, indexer.extractor_settings())
+    return [stored.page_text(i) for i in range(stored.page_count)]
+
+
+def test_fingerprint_covers_form_xobjects(tmp_path):
+    form_xobject_pdf(tmp_path / "alpha.pdf", "The answer is alpha")
+    form_xobject_pdf(tmp_path / "omega.pdf", "The answer is omega")
+    fingerprints = []
+    for name in ("alpha.pdf", "omega.pdf"):
+        with fitz.open(tmp_path / name) as doc:
+            assert doc[0].read_contents().strip() == b"q /fzFrm0 Do Q"
+            fingerprints.append(extraction.page_fingerprint(doc, doc[0]))
+    assert fingerprints[0] != fingerprints[1]
+
+
+def test_fingerprint_is_stable(tmp_path):
+    text_page_pdf(tmp_path / "a.pdf", "one", "two")
+    text_page_pdf(tmp_path / "b.pdf", "one", "three")
+    with fitz.open(tmp_path / "a.pdf") as a, fitz.open(tmp_path / "b.pdf") as b:
+        assert extraction.page_fingerprint(a, a[0]) == extraction.page_fingerprint(b, b[0])
+        assert extraction.page_fingerprint(a, a[1]) != extraction.page_fingerprint(b, b[1])
+
+
+def test_reindex_picks_up_changed_form_xobject(tmp_path):
+    path = tmp_path / "x.pdf"
+    form_xobject_pdf(tmp_path / "alpha.pdf", "The answer is alpha")
+    form_xobject_pdf(tmp_path / "omega.pdf", "The answer is omega")
+    shutil.copy(tmp_path / "alpha.pdf", path)
+    assert load_page_texts(path, tmp_path / "cache") == ["The answer is alpha"]
+    shutil.copy(tmp_path / "omega.pdf", path)
+    assert load_page_texts(path, tmp_path / "cache") == ["The answer is omega"]
+
+
+def test_reindex_extracts_only_changed_pages(tmp_path, monkeypatch):
+    path = tmp_path / "chapter.pdf"
+    text_page_pdf(path, "ohm law voltage current", "newton force mass", "capacitor charge energy")
+    load_page_texts(path, tmp_path / "cache")
+
+    text_page_pdf(path, "ohm law voltage current", "kinetic energy velocity", "capacitor charge energy")
+    reused = []
+    extract = DocumentIndexer.extract_pdf_pages
+
+    def spy(self, file_path, workers=None, known=None):
+        reused.append(sorted(known or {}))
+        return extract(self, file_path, workers, known)
+
+    monkeypatch.setattr(DocumentIndexer, "extract_pdf_pages", spy)
+    indexer = DocumentIndexer(str(tmp_path / "cache"))
+    indexer.extract_workers = 1
+    _, stored = indexer.load_index(str(path))
+    assert reused == [[0, 2]]
+    assert [stored.page_text(i) for i in range(3)] == [
+        "ohm law voltage current", "kinetic energy velocity", "capacitor charge energy"]
+    # The patched BM25 postings score like an index built from scratch
+    fresh = BM25Index(stored.chunks())
+    for query in ("energy", "velocity", "newton", "ohm current"):
+        assert dict(stored.retriever.search(query, 5)) == pytest.approx(dict(fresh.search(query, 5)))
+    assert stored.retriever.search("newton") == []
+
+
+def test_page_index_is_safe_across_threads(tmp_path):
+    paths = []
+    for i in range(6):
+        paths.append(tmp_path / f"doc{i}.pdf")
+        text_page_pdf(paths[-1], f"document {i} first page", f"document {i} ohm law")
+    indexer = DocumentIndexer(str(tmp_path / "cache"))
+    indexer.max_page_indexes = 2
+    errors = []
+
+    def worker(offset):
+        try:
+            for n in range(30):
+                path = paths[(offset + n) % len(paths)]
+                index = indexer.page_index(str(path))
+                assert index.pages[1].endswith("ohm law")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(indexer.page_indexes) <= 2
+
+
+def test_worker_copy_pickles():
+    copy = pickle.loads(pickle.dumps(DocumentIndexer().worker_copy()))
+    assert copy.page_index  # usable after unpickling, with its own lock
+    assert copy._page_index_lock is not None
@@ -0,0 +1,109 @@
+import ctypes
+
+from prefix_cache import PrefixCachedModel
+
+CAPACITY = 4096
+
+
+class PromptContext(ctypes.Structure):
+    _fields_ = [("tokens", ctypes.POINTER(ctypes.c_int32)),
+                ("tokens_size", ctypes.c_size_t),
+                ("n_past", ctypes.c_int32)]
+
+
+class FakeLLModel:
+    """Stands in for gpt4all's LLModel: one token per character, a KV cache
+    restored by the state API, and a token history that, like llmodel's, is
+    not part of the state but feeds repeat_penalty."""
+
+    def __init__(self):
+        self.model = self
+        self.kv = []
+        self.history = (ctypes.c_int32 * CAPACITY)()
+        self.context = PromptContext(ctypes.cast(self.history, ctypes.POINTER(ctypes.c_int32)), 0, 0)
+
+    def _evaluate(self, text, reset_context):
+        if reset_context:
+            self.context.n_past = 0
+        n_past = self.context.n_past
+        del self.kv[n_past:]
+        self.context.tokens_size = min(self.context.tokens_size, n_past)
+        for char in text:
+            self._push(ord(char))
+
+    def _push(self, token):
+        self.kv.append(token)
+        self.history[self.context.tokens_size] = token
+        self.context.tokens_size += 1
+        self.context.n_past += 1
+
+    def prompt_model(self, prompt, template, callback, n_predict=0, n_batch=8, reset_context=False):
+        self._evaluate(prompt, reset_context)
+
+    def prompt_model_streaming(self, prompt, template, callback, reset_context=False,
+                               n_predict=16, repeat_last_n=64, **kwargs):
+        self._evaluate(prompt, reset_context)
+        for _ in range(n_predict):
+            recent = self.history[max(0, self.context.tokens_size - repeat_last_n):self.context.tokens_size]
+            token = ord("a") + (sum(self.kv) * 31 + sum(recent) * 7) % 26
+            self._push(token)
+            if not callback(token, chr(token)):
+                return
+            yield chr(token)
+
+
+class FakeStateApi:
+    @staticmethod
+    def llmodel_get_state_size(llm):
+        return 4 * (CAPACITY + 1)
+
+    @staticmethod
+    def llmodel_save_state_data(llm, buffer):
+        data = (ctypes.c_int32 * (len(llm.kv) + 1))(len(llm.kv), *llm.kv)
+        ctypes.memmove(buffer, data, ctypes.sizeof(data))
+        return ctypes.sizeof(data)
+
+    @staticmethod
+    def llmodel_restore_state_data(llm, buffer):
+        words = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_int32))
+        llm.kv = words[1:words[0] + 1]
+        return 4 * (words[0] + 1)
+
+
+class FakeGPT4All:
+    def __init__(self):
+        self.model = FakeLLModel()
+
+    def generate(self, prompt, streaming=False, callback=None, max_tokens=200, **kwargs):
+        tokens = self.model.prompt_model_streaming(prompt, "%1", lambda *_: True, reset_context=True,
+                                                   n_predict=max_tokens, **kwargs)
+        return tokens if streaming else "".join(tokens)
+
+
+def cached_model():
+    model = PrefixCachedModel(FakeGPT4All())
+    model._api = FakeStateApi
+    return model
+
+
+def test_restored_prefix_gives_the_same_output_as_no_cache():
+    first = "Explain briefly. Context: Ohm's law. Question: what is V?"
+    other = "Summarize this chapter in detail. Context: Newton's laws."
+    prompts = [(first, first[:16]), (other, other[:33]), (first, first[:16])]
+    plain = FakeGPT4All()
+    cached = cached_model()
+    outputs = []
+    for prompt, prefix in prompts:
+        expected = plain.generate(prompt, max_tokens=24)
+        assert cached.generate(prompt, prefix=prefix, max_tokens=24) == expected
+        outputs.append(expected)
+    assert outputs[0] == outputs[2]
+    assert len(cached.states) == 2  # the third prompt restored the first prefix
+
+
+def test_restore_skipped_when_history_is_shorter_than_the_prefix():
+    prompt = "Explain briefly. Context: Ohm's law. Question: what is V?"
+    cached = cached_model()
+    cached.generate(prompt, prefix=prompt[:16], max_tokens=4)
+    cached.model.model.context.tokens_size = 3
+    assert not cached._restore(cached.model.model, prompt[:16])
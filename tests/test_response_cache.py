@@ -0,0 +1,63 @@
+import time
+
+from response_cache import ResponseCache
+
+
+def test_key_covers_prompt_model_and_params():
+    key = ResponseCache.make_key("prompt", "stub", {"temp": 0.7, "max_tokens": 200})
+    assert key == ResponseCache.make_key("prompt", "stub", {"max_tokens": 200, "temp": 0.7})
+    assert key != ResponseCache.make_key("prompt", "other", {"temp": 0.7, "max_tokens": 200})
+    assert key != ResponseCache.make_key("prompt", "stub", {"temp": 0.8, "max_tokens": 200})
+    assert key != ResponseCache.make_key("prompt!", "stub", {"temp": 0.7, "max_tokens": 200})
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"  # b is now the oldest
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = ResponseCache(ttl=60)
+    cache.put("a", "A")
+    assert cache.get("a") == "A"
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    ResponseCache(disk_dir=str(tmp_path)).put("a", "A")
+    cache = ResponseCache(disk_dir=str(tmp_path))
+    assert cache.get("a") == "A"
+    assert cache.get("a") == "A"
+    assert cache.stats()["disk_hits"] == 1  # the second hit came from memory
+
+
+def test_expired_disk_entries_are_removed(tmp_path, monkeypatch):
+    ResponseCache(ttl=60, disk_dir=str(tmp_path)).put("a", "A")
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert ResponseCache(ttl=60, disk_dir=str(tmp_path)).get("a") is None
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_disk_tier_is_pruned_to_its_limit(tmp_path):
+    cache = ResponseCache(max_entries=8, disk_dir=str(tmp_path), max_disk_entries=10)
+    for i in range(64):
+        cache.put(f"key{i}", str(i))
+    assert len(list(tmp_path.glob("*.json"))) == 10
+
+
+def test_clear_empties_both_tiers(tmp_path):
+    cache = ResponseCache(disk_dir=str(tmp_path))
+    cache.put("a", "A")
+    cache.clear()
+    assert cache.get("a") is None
+    assert not list(tmp_path.glob("*.json"))
@@ -0,0 +1,27 @@
+from retrieval import BM25Index
+
+CHUNKS = [
+    "ohm law relates voltage current and resistance",
+    "newton second law force equals mass times acceleration",
+    "capacitors store charge and energy in an electric field",
+    "power is the rate of doing work, voltage times current",
+]
+
+
+def test_search_ranks_matching_chunk_first():
+    index = BM25Index(CHUNKS)
+    assert index.search("mass acceleration")[0][0] == 1
+    assert index.search("nothing relevant") == []
+
+
+def test_patched_matches_fresh_index():
+    old = BM25Index(CHUNKS)
+    # Drop chunk 1, keep the others (renumbered) and add two new chunks
+    id_map = {0: 0, 2: 1, 3: 2}
+    added = [(3, "kinetic energy is half mass times velocity squared"), (4, "voltage drop across a resistor")]
+    patched = BM25Index.patched(old, id_map, added)
+    fresh = BM25Index([CHUNKS[0], CHUNKS[2], CHUNKS[3]] + [text for _, text in added])
+    assert patched.doc_lens == fresh.doc_lens
+    assert patched.total_len == fresh.total_len
+    for query in ("voltage", "mass", "energy", "force", "current resistance"):
+        assert patched.search(query, 10) == fresh.search(query, 10)
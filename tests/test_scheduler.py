@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobCancelled
+from scheduler import BATCH, INTERACTIVE, DeadlineExceeded, Scheduler, SchedulerFull
+
+
+def run_jobs(scheduler, jobs, hold=0.05):
+    """Start (name, priority) jobs while a batch job holds the only slot; return the order they ran in."""
+    order = []
+
+    def job(name, priority, seconds):
+        with scheduler.slot(priority):
+            order.append(name)
+            time.sleep(seconds)
+
+    threads = [threading.Thread(target=job, args=("first", BATCH, 0.3))]
+    threads[0].start()
+    time.sleep(0.05)
+    for name, priority in jobs:
+        threads.append(threading.Thread(target=job, args=(name, priority, hold)))
+        threads[-1].start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_interactive_before_batch():
+    order = run_jobs(Scheduler(), [("b1", BATCH), ("b2", BATCH), ("i1", INTERACTIVE), ("i2", INTERACTIVE)])
+    assert order == ["first", "i1", "i2", "b1", "b2"]
+
+
+def test_waiting_batch_ages_into_interactive():
+    order = run_jobs(Scheduler(batch_aging=0.1), [("b1", BATCH), ("i1", INTERACTIVE)])
+    assert order == ["first", "b1", "i1"]
+
+
+def test_full_queue_rejects_at_once():
+    scheduler = Scheduler(max_queued={INTERACTIVE: 1, BATCH: 1})
+    release = threading.Event()
+
+    def hold():
+        with scheduler.slot():
+            release.wait()
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]  # one running, one queued
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    with pytest.raises(SchedulerFull):
+        with scheduler.slot():
+            pass
+    assert time.monotonic() - start < 0.05
+    assert scheduler.stats()["waiting"] == {INTERACTIVE: 1, BATCH: 0}
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert scheduler.stats() == {"running": 0, "capacity": 1, "waiting": {INTERACTIVE: 0, BATCH: 0}}
+
+
+def test_deadline_while_queued():
+    scheduler = Scheduler()
+    with scheduler.slot():
+        with scheduler.context(timeout=0.2):
+            start = time.monotonic()
+            with pytest.raises(DeadlineExceeded):
+                with scheduler.slot():
+                    pass
+    assert 0.2 <= time.monotonic() - start < 1
+    assert scheduler.stats()["waiting"][INTERACTIVE] == 0
+
+
+def test_deadline_stops_generation():
+    scheduler = Scheduler()
+    with scheduler.context(timeout=0.1):
+        with scheduler.slot() as ticket:
+            assert ticket.should_continue()
+            time.sleep(0.15)
+            assert not ticket.should_continue()
+            with pytest.raises(DeadlineExceeded):
+                ticket.check()
+
+
+def test_cancelled_request_leaves_queue():
+    scheduler = Scheduler()
+    cancelled = threading.Event()
+    errors = []
+
+    def waiter():
+        try:
+            with scheduler.context(is_cancelled=cancelled.is_set):
+                with scheduler.slot():
+                    pass
+        except JobCancelled as e:
+            errors.append(e)
+
+    with scheduler.slot():
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        cancelled.set()
+        thread.join(1)
+        assert errors and scheduler.stats()["waiting"][INTERACTIVE] == 0
+
+
+def test_no_deadline_or_cap_by_default():
+    scheduler = Scheduler()
+    assert scheduler.cap({"max_tokens": 2048}) == {"max_tokens": 2048}
+    with scheduler.slot() as ticket:
+        assert ticket.deadline is None
+    with scheduler.context(max_tokens=1024):
+        assert scheduler.cap({"max_tokens": 2048}) == {"max_tokens": 1024}
+        assert scheduler.cap({"max_tokens": 200}) == {"max_tokens": 200}
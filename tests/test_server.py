@@ -0,0 +1,200 @@
+import asyncio
+import json
+import shutil
+import time
+
+import fitz
+import pytest
+
+import server
+from backends import StubBackend
+from main import StudyBot
+from scheduler import INTERACTIVE
+
+
+class SlowStub(StubBackend):
+    """StubBackend that takes `delay` seconds per token, like a model on CPU."""
+
+    def __init__(self, answer_tokens=20, delay=0.02):
+        super().__init__(answer_tokens)
+        self.delay = delay
+
+    def stream(self, prompt, should_continue=None, **params):
+        for token in super().stream(prompt, should_continue, **params):
+            time.sleep(self.delay)
+            yield token
+
+
+@pytest.fixture
+def bot(workdir):
+    return StudyBot(backend=SlowStub())
+
+
+async def request(port, path, body=None, method="POST"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    if b"Transfer-Encoding: chunked" in head:
+        text = b""
+        while True:
+            size, _, payload = payload.partition(b"\r\n")
+            if int(size, 16) == 0:
+                break
+            text += payload[:int(size, 16)]
+            payload = payload[int(size, 16) + 2:]
+        payload = text
+    return int(head.split()[1]), payload.decode("utf-8")
+
+
+def serving(bot, scenario):
+    """Run scenario(port) against a server for bot."""
+    async def run():
+        ready = asyncio.Event()
+        servers = []
+        task = asyncio.create_task(server.serve(bot, port=0, ready=lambda s: (servers.append(s), ready.set())))
+        await ready.wait()
+        try:
+            return await scenario(servers[0].sockets[0].getsockname()[1])
+        finally:
+            task.cancel()
+
+    return asyncio.run(run())
+
+
+def test_identical_requests_share_one_generation(bot):
+    async def scenario(port):
+        return await asyncio.gather(*[request(port, "/ask", {"question": "  OHM'S LAW" if i % 2 else "Ohm's law"})
+                                      for i in range(10)])
+
+    results = serving(bot, scenario)
+    assert {status for status, _ in results} == {200}
+    assert len({body for _, body in results}) == 1
+    assert bot.backend.calls == 1
+
+
+def test_stored_formula_does_not_wait_for_the_model(bot):
+    bot.save_formula("ohm law", "V = I R")
+    bot.backend.answer_tokens = 200
+
+    async def scenario(port):
+        busy = asyncio.ensure_future(request(port, "/search", {"question": "a long answer"}))
+        await asyncio.sleep(0.2)
+        start = time.perf_counter()
+        stored = await request(port, "/ask", {"question": "Ohm's law"})
+        elapsed = time.perf_counter() - start
+        assert not busy.done()
+        await busy
+        return stored, elapsed
+
+    (status, body), elapsed = serving(bot, scenario)
+    assert status == 200 and "V = I R" in body
+    assert elapsed < 0.5
+
+
+def test_cached_search_is_answered_without_generating(bot):
+    async def scenario(port):
+        first = await request(port, "/search", {"question": "what is power"})
+        second = await request(port, "/search", {"question": "what is power"})
+        return first, second
+
+    first, second = serving(bot, scenario)
+    assert first == second
+    assert bot.backend.calls == 1
+
+
+def test_requests_beyond_the_queue_limit_get_503(bot):
+    bot.scheduler.max_queued[INTERACTIVE] = 2
+
+    async def scenario(port):
+        return await asyncio.gather(*[request(port, "/search", {"question": f"question {i}"}) for i in range(6)])
+
+    statuses = sorted(status for status, _ in serving(bot, scenario))
+    assert statuses == [200, 200, 200, 503, 503, 503]
+
+
+def test_client_that_leaves_while_queued_is_cancelled(bot):
+    async def scenario(port):
+        busy = asyncio.ensure_future(request(port, "/search", {"question": "keeps the model busy"}))
+        await asyncio.sleep(0.1)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        data = json.dumps({"question": "abandoned"}).encode()
+        writer.write(f"POST /search HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        await asyncio.sleep(0.1)
+        writer.close()
+        await busy
+        await asyncio.sleep(0.3)
+
+    serving(bot, scenario)
+    assert bot.backend.calls == 1
+    assert bot.scheduler.stats()["waiting"][INTERACTIVE] == 0
+
+
+def test_deadline_ends_the_answer(bot):
+    bot.backend.answer_tokens = 100
+
+    async def scenario(port):
+        return await request(port, "/search", {"question": "slow", "timeout": 0.2})
+
+    status, body = serving(bot, scenario)
+    assert status == 200
+    assert body.endswith("Interactive request timed out")
+
+
+def test_bad_requests(bot):
+    async def scenario(port):
+        return [
+            await request(port, "/nope", {}),
+            await request(port, "/ask", {}),
+            await request(port, "/search", {"question": "x", "timeout": "soon"}),
+            await request(port, "/query", {"question": "x"}),
+            await request(port, "/health", method="GET"),
+        ]
+
+    statuses = [status for status, _ in serving(bot, scenario)]
+    assert statuses == [404, 400, 400, 400, 200]
+
+
+def test_files_must_be_inside_documents(bot, workdir):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Ohm's law relates voltage, current and resistance.")
+    doc.save(str(workdir / "documents" / "notes.pdf"))
+    outside = workdir / "secret.pdf"
+    shutil.copy(workdir / "documents" / "notes.pdf", outside)
+
+    async def scenario(port):
+        return [
+            await request(port, "/pdf", {"file": str(outside), "question": "x"}),
+            await request(port, "/pdf", {"file": "../secret.pdf", "question": "x"}),
+            await request(port, "/index", {"file": str(outside)}),
+            await request(port, "/index", {"file": "sub/../../secret.pdf"}),
+            await request(port, "/index", {"file": "."}),
+            await request(port, "/index", {"file": "notes.pdf"}),
+            await request(port, "/pdf", {"file": "notes.pdf", "question": "what is ohm's law?"}),
+        ]
+
+    results = serving(bot, scenario)
+    assert [status for status, _ in results] == [400, 400, 400, 400, 400, 200, 200]
+    assert "inside documents/" in results[0][1]
+    assert "In-depth Study completed" in results[5][1]
+    assert results[6][1].startswith("📄 PDF Answer:")
+
+
+def test_long_formula_is_stored_whole(workdir):
+    bot = StudyBot(backend=StubBackend(answer_tokens=1500))
+
+    async def scenario(port):
+        return await request(port, "/ask", {"question": "maxwell equations"})
+
+    status, body = serving(bot, scenario)
+    assert status == 200
+    key = bot.normalize_query("maxwell equations")
+    assert body.endswith(bot.formulas_db[key])
+    assert len(bot.formulas_db[key].split()) == 1500
+    # Answers that are not stored keep the interactive cap
+    with server.StudyBotServer.request_context(bot.scheduler, "query", {}):
+        assert bot.scheduler.cap({"max_tokens": 2048}) == {"max_tokens": server.INTERACTIVE_MAX_TOKENS}